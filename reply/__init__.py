@@ -3,3 +3,7 @@ import selector
 import storage
 import learner
 import encoder
+import checkpoint
+import parallel
+import replay
+import remote
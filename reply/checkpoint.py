@@ -0,0 +1,285 @@
+"""Checkpoint functions.
+
+A checkpoint is a numpy .npz file with the storage arrays, the state of the
+random number generators and a small JSON metadata header with the agent
+counters and the learner and selector parameters. Checkpoints are loaded
+without unpickling anything.
+
+DeltaCheckpointer adds cheap incremental checkpoints on top of that: only
+the storage rows modified since the previous checkpoint are appended to a
+log file that is replayed over the last full checkpoint when loading.
+"""
+import json
+import os
+import random
+import struct
+import tempfile
+import uuid
+import numpy
+
+__all__ = ["save", "load", "DeltaCheckpointer"]
+
+FORMAT_VERSION = 1
+
+# parameters of the components that change while learning
+LEARNER_ATTRIBUTES = ('alpha',)
+SELECTOR_ATTRIBUTES = ('epsilon', 'temperature')
+
+
+def get_attributes(component, names):
+    """Return a dictionary with the given attributes of a component."""
+    return dict((name, getattr(component, name)) for name in names
+                if hasattr(component, name))
+
+
+def get_metadata(rl):
+    """Return a dictionary with the agent counters and parameters."""
+    return {
+        'episodes': rl.episodes,
+        'total_steps': rl.total_steps,
+        'learner': get_attributes(rl.learner, LEARNER_ATTRIBUTES),
+        'selector': get_attributes(rl.selector, SELECTOR_ATTRIBUTES),
+        }
+
+
+def set_metadata(rl, metadata):
+    """Restore the agent counters and parameters from a dictionary."""
+    rl.episodes = metadata['episodes']
+    rl.total_steps = metadata['total_steps']
+    for name, value in metadata['learner'].items():
+        setattr(rl.learner, name, value)
+    for name, value in metadata['selector'].items():
+        setattr(rl.selector, name, value)
+
+
+def save(rl, filename, compress=False, tag=None):
+    """Write a checkpoint of an agent to a file.
+
+    The file is written to a temporary file first and then renamed, so an
+    existing checkpoint is never left half-written.
+
+    Arguments:
+    rl -- the RL instance to persist.
+    filename -- name of the checkpoint file.
+
+    Keyword arguments:
+    compress -- if True the arrays are zip-compressed.
+    tag -- an optional string stored in the metadata.
+    """
+    random_version, random_state, gauss_next = random.getstate()
+    name, keys, pos, has_gauss, cached_gaussian = numpy.random.get_state()
+    metadata = get_metadata(rl)
+    metadata.update({
+        'version': FORMAT_VERSION,
+        'tag': tag,
+        'random': [random_version, gauss_next],
+        'numpy_random': [name, pos, has_gauss, cached_gaussian],
+        })
+    arrays = {
+        'metadata': numpy.array(json.dumps(metadata)),
+        'random_state': numpy.array(random_state, dtype=numpy.int64),
+        'numpy_random_state': keys,
+        }
+    for key, value in rl.storage.get_arrays().items():
+        arrays['storage.' + key] = value
+
+    directory = os.path.dirname(os.path.abspath(filename))
+    fd, temp_filename = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        handler = os.fdopen(fd, 'wb')
+        try:
+            if compress:
+                numpy.savez_compressed(handler, **arrays)
+            else:
+                numpy.savez(handler, **arrays)
+            handler.flush()
+            os.fsync(handler.fileno())
+        finally:
+            handler.close()
+        os.rename(temp_filename, filename)
+    except:
+        os.remove(temp_filename)
+        raise
+
+
+def load(rl, filename):
+    """Restore an agent from a checkpoint file.
+
+    The agent must have been built with the same kind of components that
+    were used to write the checkpoint.
+
+    Arguments:
+    rl -- the RL instance to restore.
+    filename -- name of the checkpoint file.
+
+    Return the tag the checkpoint was saved with.
+    """
+    data = numpy.load(filename, allow_pickle=False)
+    try:
+        metadata = json.loads(str(data['metadata']))
+        if metadata['version'] != FORMAT_VERSION:
+            raise ValueError("unsupported checkpoint version %r" %
+                             metadata['version'])
+        rl.storage.set_arrays(dict(
+            (key[len('storage.'):], data[key]) for key in data.files
+            if key.startswith('storage.')))
+        set_metadata(rl, metadata)
+
+        random_version, gauss_next = metadata['random']
+        random.setstate((random_version,
+                         tuple(int(n) for n in data['random_state']),
+                         gauss_next))
+        name, pos, has_gauss, cached_gaussian = metadata['numpy_random']
+        numpy.random.set_state((str(name), data['numpy_random_state'], pos,
+                                has_gauss, cached_gaussian))
+    finally:
+        data.close()
+    return metadata['tag']
+
+
+class DeltaCheckpointer(object):
+
+    """Incremental checkpoints of an agent.
+
+    The first checkpoint is a full one, written with save. After that only
+    the storage rows that changed since the previous checkpoint are
+    appended to a log file next to it, together with the agent counters and
+    parameters. Every compact_every checkpoints a new full checkpoint is
+    written and the log is started over.
+
+    The storage must keep track of its changed rows (see
+    Storage.get_dirty_rows), as the table storages do.
+    """
+
+    HEADER = struct.Struct('<4sI')
+    MAGIC = 'RDLT'
+
+    def __init__(self, filename, compact_every=10, compress=False):
+        """Initialize the checkpointer.
+
+        Arguments:
+        filename -- name of the full checkpoint file. The log is written to
+                    the same name with a '.log' suffix.
+
+        Keyword arguments:
+        compact_every -- number of incremental checkpoints between full
+                         ones.
+        compress -- if True the full checkpoints are zip-compressed.
+        """
+        self.filename = filename
+        self.log_filename = filename + '.log'
+        self.compact_every = compact_every
+        self.compress = compress
+        # identifies the full checkpoint the log entries apply to
+        self.tag = None
+        self.deltas = 0
+
+    def save(self, rl):
+        """Write a checkpoint, incremental when possible."""
+        if self.tag is None or self.deltas >= self.compact_every:
+            self.compact(rl)
+        else:
+            self.append(rl)
+
+    def compact(self, rl):
+        """Write a full checkpoint and start a new log."""
+        self.tag = uuid.uuid4().hex
+        save(rl, self.filename, compress=self.compress, tag=self.tag)
+        # entries of the previous log are ignored from now on because of
+        # the tag, so a crash before this point loses nothing
+        open(self.log_filename, 'wb').close()
+        rl.storage.clear_dirty_rows()
+        self.deltas = 0
+
+    def append(self, rl):
+        """Append the rows changed since the last checkpoint to the log."""
+        rows = rl.storage.get_dirty_rows()
+        arrays = rl.storage.get_arrays()
+        names = sorted(arrays)
+        metadata = get_metadata(rl)
+        metadata.update({
+            'tag': self.tag,
+            'rows': len(rows),
+            'arrays': [[name, arrays[name].dtype.str,
+                        arrays[name][0].size] for name in names],
+            })
+        header = json.dumps(metadata)
+        chunks = [self.HEADER.pack(self.MAGIC, len(header)), header,
+                  numpy.asarray(rows, dtype='<i8').tostring()]
+        for name in names:
+            block = numpy.ascontiguousarray(arrays[name][rows])
+            chunks.append(block.tostring())
+        handler = open(self.log_filename, 'ab')
+        try:
+            handler.write(''.join(chunks))
+            handler.flush()
+            os.fsync(handler.fileno())
+        finally:
+            handler.close()
+        rl.storage.clear_dirty_rows()
+        self.deltas += 1
+
+    def load(self, rl):
+        """Restore an agent from the full checkpoint and the log.
+
+        A partially written entry at the end of the log, as left by a
+        crash, is discarded.
+        """
+        self.tag = load(rl, self.filename)
+        self.deltas = 0
+        arrays = rl.storage.get_arrays()
+        try:
+            handler = open(self.log_filename, 'r+b')
+        except IOError:
+            handler = None
+        if handler is not None:
+            try:
+                valid = 0
+                while True:
+                    metadata = self.read_entry(handler, arrays)
+                    if metadata is None:
+                        break
+                    valid = handler.tell()
+                    if metadata['tag'] == self.tag:
+                        set_metadata(rl, metadata)
+                        self.deltas += 1
+                handler.truncate(valid)
+            finally:
+                handler.close()
+        rl.storage.set_arrays(arrays)
+        rl.storage.clear_dirty_rows()
+
+    def read_entry(self, handler, arrays):
+        """Read a log entry and apply its rows to the arrays.
+
+        Return the entry metadata, or None at the end of the log.
+        """
+        data = handler.read(self.HEADER.size)
+        if len(data) < self.HEADER.size:
+            return None
+        magic, length = self.HEADER.unpack(data)
+        if magic != self.MAGIC:
+            return None
+        data = handler.read(length)
+        if len(data) < length:
+            return None
+        metadata = json.loads(data)
+        n = metadata['rows']
+        data = handler.read(8 * n)
+        if len(data) < 8 * n:
+            return None
+        rows = numpy.fromstring(data, dtype='<i8')
+        blocks = []
+        for name, dtype, columns in metadata['arrays']:
+            dtype = numpy.dtype(str(dtype))
+            size = n * columns * dtype.itemsize
+            data = handler.read(size)
+            if len(data) < size:
+                return None
+            blocks.append((name, numpy.fromstring(data, dtype=dtype)))
+        # only apply complete entries written for the current base
+        if metadata['tag'] == self.tag:
+            for name, block in blocks:
+                array = arrays[name]
+                array[rows] = block.reshape((n,) + array.shape[1:])
+        return metadata
@@ -1,6 +1,10 @@
 """Encoder classes."""
+import collections
+import itertools
 import numpy
 
+from rl import Dimension
+
 class Encoder(object):
 
     """Encoder base class."""
@@ -33,10 +37,27 @@ class DistanceEncoder(Encoder):
 
     """Encoder that does base conversion from variable-base to 10-base."""
 
-    def __init__(self, state_space, action_space):
+    def __init__(self, state_space, action_space, scalar_actions=False):
+        """Initialize the encoder.
+
+        Keyword arguments:
+        scalar_actions -- if True decode actions as tuples of plain python
+                          values instead of read-only numpy rows.
+
+        """
         super(DistanceEncoder, self).__init__(state_space, action_space)
+        self.state_space = [self.get_dimension(dim) for dim in state_space]
         self.input_size = self.get_space_size(self.state_space)
         self.output_size = self.get_space_size(self.action_space)
+        # mixed-radix multipliers used by the batch conversions
+        self.state_strides = self.get_space_strides(self.state_space)
+        self.action_strides = self.get_space_strides(self.action_space)
+        # every action is decoded once, up front
+        self.action_table = self.get_action_table()
+        self.action_tuples = None
+        if scalar_actions:
+            self.action_tuples = [tuple(row) for row in
+                                  self.action_table.tolist()]
         
     def encode_state(self, state):
         """Return the rl-encoding for a given world-encoded state.
@@ -44,30 +65,74 @@ class DistanceEncoder(Encoder):
         Do base convertion from variable-base state to 10-based state number.
 
         """
-        m = 1
         encoded_state = 0
-        for dim, v in zip(self.state_space, state):
-            n = numpy.argmin( (dim-v)**2 )
-            encoded_state += n*m
-            m *= len(dim)
+        for dim, m, v in zip(self.state_space, self.state_strides, state):
+            encoded_state += dim.index_of(v) * m
         return encoded_state
         
     def decode_action(self, encoded_action):
         """Return the world-encoding for a given rl-encoded action.
 
-        Do base conversion from 10-base action number to variable-base action.
+        The action is looked up in the precomputed action table, so the
+        returned row is shared and read-only.
+
+        """
+        if self.action_tuples is not None:
+            return self.action_tuples[encoded_action]
+        return self.action_table[encoded_action]
+
+    def encode_states(self, states):
+        """Return the rl-encodings for an array of world-encoded states.
+
+        states is an (N, n_dims) array-like with one world-encoded state
+        per row. All the states are converted in a single vectorized pass
+        and an array of N encoded states is returned.
+
+        """
+        states = numpy.asarray(states, dtype=float)
+        states = states.reshape(len(states), len(self.state_space))
+        encoded_states = numpy.zeros(len(states), dtype=int)
+        for i, dim in enumerate(self.state_space):
+            encoded_states += (dim.indices_of(states[:, i]) *
+                               self.state_strides[i])
+        return encoded_states
+
+    def decode_actions(self, encoded_actions):
+        """Return the world-encodings for an array of rl-encoded actions.
+
+        The result is an (N, n_dims) array with one world-encoded action
+        per row.
 
         """
-        m = 1
+        return self.action_table[numpy.asarray(encoded_actions, dtype=int)]
+
+    def get_action_table(self):
+        """Return a read-only table with the world-encoding of every action.
 
-        action = numpy.zeros( len(self.action_space) )
+        Do base conversion from 10-base action number to variable-base action
+        for all the actions at once.
+
+        """
+        encoded_actions = numpy.arange(self.output_size)
+        table = numpy.zeros((self.output_size, len(self.action_space)))
         for i, dim in enumerate(self.action_space):
-            n = len(dim)
-            j = ( encoded_action/m ) % n
-            m *= n
-            action[i] = dim[j]
-            #print n, j, m, dim[j], dim
-        return action
+            j = (encoded_actions // self.action_strides[i]) % len(dim)
+            table[:, i] = numpy.asarray(dim)[j]
+        table.flags.writeable = False
+        return table
+
+    def get_dimension(self, dim):
+        """Return dim as a Dimension, wrapping plain arrays of points."""
+        if isinstance(dim, Dimension):
+            return dim
+        return Dimension(dim)
+
+    def get_space_strides(self, space):
+        """Return the mixed-radix multiplier of each dimension of a space."""
+        strides = [1]
+        for dim in space[:-1]:
+            strides.append(strides[-1] * len(dim))
+        return strides
 
     def get_space_size(self, space):
         """Return the size of the given space."""
@@ -75,6 +140,282 @@ class DistanceEncoder(Encoder):
         for dim in space:
             size *= len(dim)
         return size
+
+
+class TileCodingEncoder(DistanceEncoder):
+
+    """Encoder that represents a state by its tiles in several tilings.
+
+    Each tiling is a grid with the resolution of the state space, shifted by
+    a fraction of a cell, and a state activates exactly one tile in each of
+    them. The rl-encoding of a state is thus an array with one feature index
+    per tiling, and nearby states share most of their features. Actions are
+    encoded as in DistanceEncoder.
+
+    Use it together with a storage that understands multi-index states,
+    such as reply.storage.TileCodingStorage.
+    """
+
+    def __init__(self, state_space, action_space, tilings=8,
+                 scalar_actions=False):
+        """Initialize the encoder.
+
+        Keyword arguments:
+        tilings -- number of offset tilings.
+        scalar_actions -- if True decode actions as tuples of plain python
+                          values instead of read-only numpy rows.
+
+        """
+        super(TileCodingEncoder, self).__init__(
+            state_space, action_space, scalar_actions=scalar_actions)
+        self.tilings = tilings
+        n = numpy.array([len(dim) for dim in self.state_space])
+        self.low = numpy.array([numpy.min(dim) for dim in self.state_space])
+        high = numpy.array([numpy.max(dim) for dim in self.state_space])
+        self.width = numpy.where(
+            n > 1, (high - self.low) / numpy.maximum(n - 1, 1), 1.0)
+        # in-range states shifted by less than a cell stay below n, and
+        # states out of range are clipped to the border tiles
+        self.tiles = n
+        self.tile_strides = numpy.array(self.get_space_strides(
+            [range(t) for t in self.tiles]))
+        tiles_per_tiling = int(numpy.prod(self.tiles))
+        self.input_size = tilings * tiles_per_tiling
+        self.tiling_offsets = numpy.arange(tilings) * tiles_per_tiling
+        # asymmetric displacements (1, 3, 5, ...) avoid aligned tilings
+        displacement = 2 * numpy.arange(len(n)) + 1
+        self.offsets = ((numpy.arange(tilings)[:, numpy.newaxis] *
+                         displacement) % tilings) / float(tilings)
+
+    def encode_state(self, state):
+        """Return the rl-encoding for a given world-encoded state.
+
+        The result is an array with the active feature of each tiling.
+
+        """
+        v = (numpy.asarray(state, dtype=float) - self.low) / self.width
+        coords = numpy.floor(v + self.offsets).astype(int)
+        numpy.clip(coords, 0, self.tiles - 1, out=coords)
+        return coords.dot(self.tile_strides) + self.tiling_offsets
+
+    def encode_states(self, states):
+        """Return the rl-encodings for an array of world-encoded states.
+
+        The result is an (N, tilings) array of active features.
+
+        """
+        states = numpy.asarray(states, dtype=float)
+        states = states.reshape(len(states), len(self.state_space))
+        v = (states - self.low) / self.width
+        coords = numpy.floor(v[:, numpy.newaxis, :] + self.offsets).astype(int)
+        numpy.clip(coords, 0, self.tiles - 1, out=coords)
+        return coords.dot(self.tile_strides) + self.tiling_offsets
+
+
+class ScalingEncoder(DistanceEncoder):
+
+    """Encoder that represents a state by its values scaled to [-1, 1].
+
+    The range of each dimension is taken from the state space. The
+    rl-encoding of a state is a feature vector of input_size floats, meant
+    for function approximation storages such as
+    reply.storage.LinearStorage. Actions are encoded as in DistanceEncoder.
+    """
+
+    def __init__(self, state_space, action_space, bias=True,
+                 scalar_actions=False):
+        """Initialize the encoder.
+
+        Keyword arguments:
+        bias -- if True append a constant feature of 1 to every state.
+        scalar_actions -- if True decode actions as tuples of plain python
+                          values instead of read-only numpy rows.
+
+        """
+        super(ScalingEncoder, self).__init__(
+            state_space, action_space, scalar_actions=scalar_actions)
+        low = numpy.array([numpy.min(dim) for dim in self.state_space])
+        high = numpy.array([numpy.max(dim) for dim in self.state_space])
+        self.center = (high + low) / 2.0
+        self.scale = numpy.where(high > low, (high - low) / 2.0, 1.0)
+        self.bias = bias
+        self.input_size = len(self.state_space) + (1 if bias else 0)
+
+    def encode_state(self, state):
+        """Return the rl-encoding for a given world-encoded state."""
+        return self.encode_states([state])[0]
+
+    def encode_states(self, states):
+        """Return the rl-encodings for an array of world-encoded states.
+
+        The result is an (N, input_size) array of features.
+
+        """
+        states = numpy.asarray(states, dtype=float)
+        states = states.reshape(len(states), len(self.state_space))
+        features = numpy.ones((len(states), self.input_size))
+        features[:, :len(self.state_space)] = (
+            (states - self.center) / self.scale)
+        return features
+
+
+class HashingEncoder(DistanceEncoder):
+
+    """Encoder that hashes world states into a fixed number of buckets.
+
+    Meant for discrete state spaces too large to be stored densely: the
+    table only needs one row per bucket, at the price of states sharing a
+    row when they collide. World-encoded states must be sequences of
+    hashable values. Actions are encoded as in DistanceEncoder.
+    """
+
+    def __init__(self, state_space, action_space, buckets,
+                 track_collisions=False, scalar_actions=False):
+        """Initialize the encoder.
+
+        Arguments:
+        buckets -- number of rl-encoded states.
+
+        Keyword arguments:
+        track_collisions -- if True keep the collision statistics.
+        scalar_actions -- if True decode actions as tuples of plain python
+                          values instead of read-only numpy rows.
+
+        """
+        super(HashingEncoder, self).__init__(
+            state_space, action_space, scalar_actions=scalar_actions)
+        self.input_size = buckets
+        self.track_collisions = track_collisions
+        # first state seen in each bucket
+        self.owners = {}
+        self.lookups = 0
+        self.collisions = 0
+
+    @property
+    def occupied(self):
+        """Return the number of buckets that have been used."""
+        return len(self.owners)
+
+    @property
+    def load_factor(self):
+        """Return the fraction of the buckets that have been used."""
+        return len(self.owners) / float(self.input_size)
+
+    @property
+    def collision_rate(self):
+        """Return the fraction of lookups that landed on a bucket owned by
+        another state."""
+        if not self.lookups:
+            return 0.0
+        return self.collisions / float(self.lookups)
+
+    def encode_state(self, state):
+        """Return the rl-encoding for a given world-encoded state."""
+        key = tuple(state)
+        encoded_state = hash(key) % self.input_size
+        if self.track_collisions:
+            self.lookups += 1
+            owner = self.owners.setdefault(encoded_state, key)
+            if owner != key:
+                self.collisions += 1
+        return encoded_state
+
+    def encode_states(self, states):
+        """Return the rl-encodings for an array of world-encoded states."""
+        return numpy.array([self.encode_state(state) for state in states],
+                           dtype=int)
+
+
+class CachingEncoder(Encoder):
+
+    """Encoder that memoizes the state encodings of another encoder.
+
+    Useful for worlds with small discrete states that are visited over and
+    over again. The world-encoded states must be tuples or sequences of
+    hashable values.
+    """
+
+    def __init__(self, encoder, max_size=100000):
+        """Initialize the encoder.
+
+        Arguments:
+        encoder -- the Encoder whose state encodings are cached.
+
+        Keyword arguments:
+        max_size -- maximum number of cached states, the least recently used
+                    ones are discarded first. None means unbounded.
+
+        Raises ValueError if max_size is smaller than one.
+        """
+        if max_size is not None and max_size < 1:
+            raise ValueError("max_size must be at least 1, got %r" %
+                             max_size)
+        super(CachingEncoder, self).__init__(encoder.state_space,
+                                             encoder.action_space)
+        self.encoder = encoder
+        self.input_size = encoder.input_size
+        self.output_size = encoder.output_size
+        self.max_size = max_size
+        self.cache = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def encode_state(self, state):
+        """Return the rl-encoding for a given world-encoded state."""
+        key = self.get_key(state)
+        try:
+            encoded_state = self.cache.pop(key)
+            self.hits += 1
+        except KeyError:
+            encoded_state = self.encoder.encode_state(state)
+            self.misses += 1
+            if self.max_size is not None and len(self.cache) >= self.max_size:
+                self.cache.popitem(last=False)
+        # (re)insert as the most recently used entry
+        self.cache[key] = encoded_state
+        return encoded_state
+
+    def encode_states(self, states):
+        """Return the rl-encodings for an array of world-encoded states."""
+        return self.encoder.encode_states(states)
+
+    def decode_action(self, encoded_action):
+        """Return the world-encoding for a given rl-encoded action."""
+        return self.encoder.decode_action(encoded_action)
+
+    def decode_actions(self, encoded_actions):
+        """Return the world-encodings for an array of rl-encoded actions."""
+        return self.encoder.decode_actions(encoded_actions)
+
+    def get_key(self, state):
+        """Return the hashable cache key for a world-encoded state."""
+        if isinstance(state, tuple):
+            return state
+        return tuple(state)
+
+    def warm(self, states=None):
+        """Fill the cache in advance.
+
+        Encode each of the given world-encoded states. If no states are given
+        the whole state space is enumerated, which only makes sense when it
+        fits in the cache.
+        """
+        if states is None:
+            size = 1
+            for dim in self.state_space:
+                size *= len(dim)
+            if self.max_size is not None and size > self.max_size:
+                raise ValueError("state space of %d states does not fit in "
+                                 "a cache of %d" % (size, self.max_size))
+            states = itertools.product(*self.state_space)
+        for state in states:
+            self.encode_state(state)
+
+    def clear(self):
+        """Empty the cache and reset the hit and miss counters."""
+        self.cache.clear()
+        self.hits = 0
+        self.misses = 0
         
 
 if __name__ == "__main__":
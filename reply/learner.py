@@ -1,4 +1,30 @@
 """Learner classes."""
+import heapq
+import numpy
+
+def get_occurrences(states, actions):
+    """Return, for every (state, action) pair of the arrays, how many times
+    it appeared before in them."""
+    if len(actions) == 0:
+        return numpy.zeros(0, dtype=int)
+    states = numpy.asarray(states)
+    actions = numpy.asarray(actions)
+    if states.ndim == 1 and states.dtype.kind in 'iu':
+        # table states, one integer per pair is enough
+        keys = states * (int(actions.max()) + 1) + actions
+    else:
+        keys = numpy.column_stack((states.reshape(len(states), -1), actions))
+        keys = numpy.unique(keys, axis=0, return_inverse=True)[1]
+    order = numpy.argsort(keys, kind='mergesort')
+    sorted_keys = keys[order]
+    # position of every pair in its run of equal pairs
+    starts = numpy.r_[True, sorted_keys[1:] != sorted_keys[:-1]]
+    positions = numpy.arange(len(keys))
+    first = numpy.maximum.accumulate(numpy.where(starts, positions, 0))
+    occurrences = numpy.zeros(len(keys), dtype=int)
+    occurrences[order] = positions - first
+    return occurrences
+
 
 class Learner(object):        
 
@@ -15,12 +41,31 @@ class Learner(object):
         """
         pass
         
-    def update(self, state, action, reward, next_state):
+    def update(self, state, action, reward, next_state, done=False,
+               weight=1):
         """Update the (state, action, next_state) -> reward relationship.
         
-        The parameters are received in rl-encoding.
+        The parameters are received in rl-encoding. done tells that
+        next_state is final, so there is no value to bootstrap from, and
+        weight scales the size of the update (e.g. an importance-sampling
+        weight of prioritized replay).
+
+        Return the TD error of the transition.
         """
         raise NotImplementedError()
+
+    def update_batch(self, states, actions, rewards, next_states, dones,
+                     weights=None):
+        """Update from arrays of transitions, one after the other.
+
+        The parameters are received in rl-encoding. Return the array of TD
+        errors.
+        """
+        if weights is None:
+            weights = numpy.ones(len(states))
+        return numpy.array([
+            self.update(*transition) for transition in
+            zip(states, actions, rewards, next_states, dones, weights)])
         
         
 class QLearner(Learner):
@@ -43,7 +88,7 @@ class QLearner(Learner):
         self.alpha_decay = alpha_decay
         self.min_alpha = min_alpha
         self.gamma = gamma
-        super(QLearner).__init__(self)
+        super(QLearner, self).__init__()
         
     def new_episode(self):
         """Start a new episode."""
@@ -52,45 +97,537 @@ class QLearner(Learner):
         if self.min_alpha is not None:
             self.alpha = max(self.min_alpha, self.alpha)
         
-    def update(self, state, action, reward, next_state):
+    def update(self, state, action, reward, next_state, done=False,
+               weight=1):
         """Update the (state, action, next_state) -> reward relationship."""
         prev_value = self.rl.storage.get_value(state, action)
-        max_value_next = self.rl.storage.get_max_value( next_state )
+        if done:
+            max_value_next = 0
+        else:
+            max_value_next = self.rl.storage.get_max_value( next_state )
         
-        new_value = (
-            prev_value + self.alpha *  
-            ( reward + self.gamma*max_value_next - prev_value )       
-            )
+        td_error = reward + self.gamma*max_value_next - prev_value
           
         #print "%f + %f * ( %f + %f * %f - %f )"%(
         #    prev_value, self.alpha, reward, self.gamma, max_value_next, 
         #    prev_value)
         
-        #print "state:", state, prev_value, "->", next_state, new_value, 
         #print "(r=%i, a=%i)"%(reward, action)
         #print "max_next", max_value_next
-        self.rl.storage.store_value(state, action, new_value)
+        self.rl.storage.update(state, action,
+                               weight * self.alpha * td_error)
+        return td_error
+
+    def update_batch(self, states, actions, rewards, next_states, dones,
+                     weights=None):
+        """Update from arrays of transitions at once.
+
+        The transitions are applied in rounds in which every (state,
+        action) pair appears at most once, so a repeated pair is updated
+        from the value left by its previous occurrence, as it would be one
+        transition after the other. Within a round the TD errors are
+        computed from the values before the round.
+        The parameters are received in rl-encoding. Return the array of TD
+        errors.
+        """
+        states = numpy.asarray(states)
+        actions = numpy.asarray(actions)
+        rewards = numpy.asarray(rewards)
+        next_states = numpy.asarray(next_states)
+        dones = numpy.asarray(dones, dtype=bool)
+        if weights is None:
+            weights = numpy.ones(len(states))
+        weights = numpy.asarray(weights)
+        td_errors = numpy.zeros(len(states))
+        rounds = get_occurrences(states, actions)
+        for round in range(rounds.max() + 1 if len(rounds) else 0):
+            batch = numpy.flatnonzero(rounds == round)
+            td_errors[batch] = self.update_unique(
+                states[batch], actions[batch], rewards[batch],
+                next_states[batch], dones[batch], weights[batch])
+        return td_errors
+
+    def update_unique(self, states, actions, rewards, next_states, dones,
+                      weights):
+        """Update from arrays of transitions with distinct (state, action)
+        pairs, all computed from the current values.
+
+        Return the array of TD errors.
+        """
+        td_errors = self.get_td_errors(states, actions, rewards, next_states,
+                                       dones)
+        self.rl.storage.update_values(states, actions,
+                                      weights * self.alpha * td_errors)
+        return td_errors
+
+    def get_td_errors(self, states, actions, rewards, next_states, dones):
+        """Return the TD errors of arrays of transitions under the current
+        values, without learning from them.
+
+        The parameters are received in rl-encoding.
+        """
+        prev_values = self.rl.storage.get_values(states, actions)
+        next_values = self.get_next_values(next_states,
+                                           numpy.asarray(dones, dtype=bool))
+        return numpy.asarray(rewards) + self.gamma * next_values - prev_values
+
+    def get_next_values(self, next_states, dones):
+        """Return the values bootstrapped from an array of next states,
+        0 for the final ones."""
+        values = self.rl.storage.get_max_values(next_states)
+        return numpy.where(dones, 0, values)
             
 
 class SarsaLearner(QLearner):       
 
     """Learner class implemeting the Sarsa algorithm."""
 
-    def update(self, state, action, reward, next_state):
+    def update(self, state, action, reward, next_state, done=False,
+               weight=1):
         """Update the (state, action, next_state) -> reward relationship."""
         prev_value = self.rl.storage.get_value(state, action)
-        next_action = self.rl.selector.select_action(
-             next_state 
-            )
-        max_value_next = self.rl.storage.get_value(next_state, next_action)
+        if done:
+            max_value_next = 0
+        else:
+            next_action = self.rl.selector.select_action(
+                 next_state 
+                )
+            max_value_next = self.rl.storage.get_value(next_state,
+                                                       next_action)
         
-        new_value = (
-            prev_value + self.alpha *  
-            ( reward + self.gamma*max_value_next - prev_value )       
-            )
-          
+        td_error = reward + self.gamma*max_value_next - prev_value
         
-        #print "state:", state, prev_value, "->", new_value, 
         #print "(r=%i, a=%i)"%(reward, action)
         #print "max_next", max_value_next
-        self.rl.storage.store_value(state, action, new_value)
+        self.rl.storage.update(state, action,
+                               weight * self.alpha * td_error)
+        return td_error
+
+    def get_next_values(self, next_states, dones):
+        """Return the values of the actions the selector picks in an array
+        of next states, 0 for the final ones."""
+        values = numpy.zeros(len(dones))
+        live = numpy.flatnonzero(~dones)
+        if len(live):
+            next_states = numpy.asarray(next_states)[live]
+            next_actions = [self.rl.selector.select_action(next_state)
+                            for next_state in next_states]
+            values[live] = self.rl.storage.get_values(next_states,
+                                                      next_actions)
+        return values
+
+
+class QLambdaLearner(QLearner):
+
+    """Learner class implementing Watkins's Q(lambda) algorithm.
+
+    Every step the TD error updates all the recently visited (state,
+    action) pairs in proportion to their eligibility trace, so a reward
+    reaches many states back at once. Traces decay by gamma * trace_decay
+    each step, are dropped below the cutoff and are cleared when an
+    exploratory action is taken or a new episode starts. They are kept
+    sparsely, as arrays of the pairs with a nonzero trace, and all of them
+    are updated with one storage.update_values call.
+    """
+
+    # exploratory actions cut the traces
+    cut_traces = True
+
+    def __init__(self, alpha, gamma, trace_decay=0.9, alpha_decay=1,
+                 min_alpha=None, cutoff=0.01, replacing=False):
+        """Initialize the learner.
+
+        Arguments:
+        alpha -- learning rate
+        gamma -- discount rate
+
+        Keyword arguments:
+        trace_decay -- the lambda parameter, how fast traces decay besides
+                       the discount.
+        alpha_decay -- learning rate decay
+        min_alpha   -- minimum learning rate
+        cutoff      -- traces below this value are dropped.
+        replacing   -- if True a visit sets the trace to 1 instead of
+                       adding 1 to it.
+        """
+        super(QLambdaLearner, self).__init__(alpha, gamma, alpha_decay,
+                                             min_alpha)
+        self.trace_decay = trace_decay
+        self.cutoff = cutoff
+        self.replacing = replacing
+        self.clear_traces()
+
+    def new_episode(self):
+        """Start a new episode."""
+        super(QLambdaLearner, self).new_episode()
+        self.clear_traces()
+
+    def clear_traces(self):
+        """Forget all the traces."""
+        self.trace_states = None
+        self.trace_actions = numpy.zeros(0, dtype=int)
+        self.traces = numpy.zeros(0)
+
+    def decay_traces(self):
+        """Decay the traces one step, dropping those below the cutoff."""
+        self.traces *= self.gamma * self.trace_decay
+        keep = self.traces >= self.cutoff
+        if not keep.all():
+            self.trace_states = self.trace_states[keep]
+            self.trace_actions = self.trace_actions[keep]
+            self.traces = self.traces[keep]
+
+    def visit(self, state, action):
+        """Raise the trace of a (state, action) pair."""
+        state = numpy.asarray(state)
+        if self.trace_states is None:
+            self.trace_states = numpy.zeros((0,) + state.shape,
+                                            dtype=state.dtype)
+        same = (self.trace_states == state).reshape(len(self.traces),
+                                                        state.size)
+        found = numpy.flatnonzero(same.all(axis=1) &
+                                  (self.trace_actions == action))
+        if len(found):
+            if self.replacing:
+                self.traces[found] = 1
+            else:
+                self.traces[found] += 1
+            return
+        self.trace_states = numpy.concatenate(
+            (self.trace_states, state[numpy.newaxis]))
+        self.trace_actions = numpy.append(self.trace_actions, action)
+        self.traces = numpy.append(self.traces, 1.0)
+
+    def get_next_value(self, next_state):
+        """Return the value bootstrapped from the next state."""
+        return self.rl.storage.get_max_value(next_state)
+
+    def update(self, state, action, reward, next_state, done=False,
+               weight=1):
+        """Update the (state, action, next_state) -> reward relationship."""
+        storage = self.rl.storage
+        prev_value = storage.get_value(state, action)
+        if len(self.traces):
+            if (self.cut_traces and
+                    prev_value < storage.get_max_value(state)):
+                # the previous traces do not lead to the greedy policy
+                self.clear_traces()
+            else:
+                self.decay_traces()
+        if done:
+            next_value = 0
+        else:
+            next_value = self.get_next_value(next_state)
+        td_error = reward + self.gamma * next_value - prev_value
+        self.visit(state, action)
+        storage.update_values(self.trace_states, self.trace_actions,
+                              weight * self.alpha * td_error * self.traces)
+        if done:
+            self.clear_traces()
+        return td_error
+
+
+class SarsaLambdaLearner(QLambdaLearner):
+
+    """Learner class implementing the Sarsa(lambda) algorithm.
+
+    Like QLambdaLearner, but the next value is that of the action the
+    selector picks, and traces are not cut by exploratory actions.
+    """
+
+    cut_traces = False
+
+    def get_next_value(self, next_state):
+        """Return the value of the action the selector picks in the next
+        state."""
+        next_action = self.rl.selector.select_action(next_state)
+        return self.rl.storage.get_value(next_state, next_action)
+
+
+class DynaQLearner(QLearner):
+
+    """Learner class implementing the Dyna-Q algorithm.
+
+    Besides learning from every real step like QLearner, the learner keeps
+    a model of the world with the last reward and next state observed for
+    every (state, action) pair, and after each real step does a number of
+    planning updates from pairs sampled among those observed. This trades
+    computation for interaction with the world, which pays off when
+    World.do_action is expensive.
+
+    The model is a set of arrays with one entry per (state, action) pair,
+    so states must be integers, as with reply.storage.TableStorage. The
+    planning updates are done with update_batch, a batch at a time.
+    """
+
+    def __init__(self, alpha, gamma, planning_steps=10, alpha_decay=1,
+                 min_alpha=None, planning_batch=None):
+        """Initialize the learner.
+
+        Arguments:
+        alpha -- learning rate
+        gamma -- discount rate
+
+        Keyword arguments:
+        planning_steps -- number of planning updates per real step.
+        alpha_decay -- learning rate decay
+        min_alpha   -- minimum learning rate
+        planning_batch -- number of planning updates done at once, all of
+                          them by default. Smaller batches let values
+                          propagate further within a step.
+        """
+        super(DynaQLearner, self).__init__(alpha, gamma, alpha_decay,
+                                           min_alpha)
+        self.planning_steps = planning_steps
+        if planning_batch is None:
+            planning_batch = planning_steps
+        self.planning_batch = planning_batch
+        self.model_rewards = None
+        self.model_next_states = None
+        self.model_dones = None
+        self.seen = None
+        self.observed = None
+        self.observed_count = 0
+
+    def create_model(self):
+        """Allocate the model arrays for the states and actions of the
+        encoder."""
+        encoder = self.rl.encoder
+        shape = (encoder.input_size, encoder.output_size)
+        self.model_rewards = numpy.zeros(shape)
+        self.model_next_states = numpy.zeros(shape, dtype=numpy.int32)
+        self.model_dones = numpy.zeros(shape, dtype=bool)
+        # flat indices of the observed pairs, in order of observation
+        self.observed = numpy.zeros(min(1024, shape[0] * shape[1]),
+                                    dtype=numpy.int64)
+        self.observed_count = 0
+        self.seen = numpy.zeros(shape, dtype=bool)
+
+    def record(self, state, action, reward, next_state, done):
+        """Store an observed transition in the model."""
+        if self.model_rewards is None:
+            self.create_model()
+        self.model_rewards[state, action] = reward
+        self.model_next_states[state, action] = next_state
+        self.model_dones[state, action] = done
+        if not self.seen[state, action]:
+            self.seen[state, action] = True
+            if self.observed_count == len(self.observed):
+                self.observed = numpy.concatenate(
+                    (self.observed, numpy.zeros_like(self.observed)))
+            self.observed[self.observed_count] = numpy.ravel_multi_index(
+                (state, action), self.seen.shape)
+            self.observed_count += 1
+
+    def plan(self):
+        """Do the planning updates from pairs sampled from the model."""
+        remaining = self.planning_steps
+        while remaining > 0:
+            size = min(remaining, self.planning_batch)
+            remaining -= size
+            pairs = self.observed[numpy.random.randint(0, self.observed_count,
+                                                       size)]
+            states, actions = numpy.unravel_index(pairs, self.seen.shape)
+            self.update_batch(states, actions,
+                              self.model_rewards[states, actions],
+                              self.model_next_states[states, actions],
+                              self.model_dones[states, actions])
+
+    def update(self, state, action, reward, next_state, done=False,
+               weight=1):
+        """Update the (state, action, next_state) -> reward relationship,
+        then plan."""
+        td_error = super(DynaQLearner, self).update(
+            state, action, reward, next_state, done, weight)
+        self.record(state, action, reward, next_state, done)
+        if self.planning_steps:
+            self.plan()
+        return td_error
+
+
+class PrioritizedSweepingLearner(DynaQLearner):
+
+    """Learner class implementing prioritized sweeping.
+
+    Like DynaQLearner it keeps a model of the world, but instead of
+    sampling pairs at random it keeps a priority queue of the (state,
+    action) pairs keyed by the size of their TD error. Each real step puts
+    the observed pair in the queue, and planning updates the pairs with the
+    largest errors first; after updating a state, the pairs known to lead
+    to it are queued with their new errors, so changes propagate backwards
+    from where the values actually changed. This suits worlds with sparse
+    rewards.
+    """
+
+    def __init__(self, alpha, gamma, planning_steps=10, alpha_decay=1,
+                 min_alpha=None, threshold=1e-4):
+        """Initialize the learner.
+
+        Arguments:
+        alpha -- learning rate
+        gamma -- discount rate
+
+        Keyword arguments:
+        planning_steps -- maximum number of updates per real step.
+        alpha_decay -- learning rate decay
+        min_alpha   -- minimum learning rate
+        threshold -- pairs with a smaller TD error are not queued.
+        """
+        super(PrioritizedSweepingLearner, self).__init__(
+            alpha, gamma, planning_steps, alpha_decay, min_alpha)
+        self.threshold = threshold
+        # heap of (-priority, pair) and the priority of every queued pair,
+        # entries of the heap that disagree with it are stale
+        self.queue = []
+        self.queued = {}
+        # sets of the flat indices of the pairs observed to lead to every
+        # state
+        self.predecessors = {}
+        self.planning_updates = 0
+
+    def record(self, state, action, reward, next_state, done):
+        """Store an observed transition in the model."""
+        super(PrioritizedSweepingLearner, self).record(
+            state, action, reward, next_state, done)
+        pair = int(numpy.ravel_multi_index((state, action), self.seen.shape))
+        self.predecessors.setdefault(int(next_state), set()).add(pair)
+
+    def push(self, pairs, priorities):
+        """Queue the pairs whose priority is above the threshold."""
+        for pair, priority in zip(pairs, priorities):
+            if (priority > self.threshold and
+                    priority > self.queued.get(pair, 0)):
+                self.queued[pair] = priority
+                heapq.heappush(self.queue, (-priority, pair))
+
+    def sweep(self, state):
+        """Queue the pairs that lead to a state whose value changed."""
+        pairs = self.predecessors.get(int(state))
+        if not pairs:
+            return
+        pairs = numpy.fromiter(pairs, dtype=numpy.int64, count=len(pairs))
+        states, actions = numpy.unravel_index(pairs, self.seen.shape)
+        # pairs seen to lead elsewhere since
+        current = self.model_next_states[states, actions] == state
+        pairs, states, actions = (pairs[current], states[current],
+                                  actions[current])
+        next_values = numpy.where(self.model_dones[states, actions], 0,
+                                  self.rl.storage.get_max_value(state))
+        td_errors = (self.model_rewards[states, actions] +
+                     self.gamma * next_values -
+                     self.rl.storage.get_values(states, actions))
+        self.push(pairs.tolist(), numpy.abs(td_errors))
+
+    def plan(self):
+        """Update the pairs with the largest TD errors first."""
+        updates = 0
+        while self.queue and updates < self.planning_steps:
+            priority, pair = heapq.heappop(self.queue)
+            if self.queued.get(pair) != -priority:
+                continue
+            del self.queued[pair]
+            state, action = numpy.unravel_index(pair, self.seen.shape)
+            QLearner.update(self, state, action,
+                            self.model_rewards[state, action],
+                            self.model_next_states[state, action],
+                            self.model_dones[state, action])
+            self.sweep(state)
+            updates += 1
+        self.planning_updates += updates
+
+    def update(self, state, action, reward, next_state, done=False,
+               weight=1):
+        """Queue the (state, action, next_state) -> reward relationship,
+        then plan.
+
+        Return the TD error of the transition before planning.
+        """
+        self.record(state, action, reward, next_state, done)
+        if done:
+            next_value = 0
+        else:
+            next_value = self.rl.storage.get_max_value(next_state)
+        td_error = (reward + self.gamma * next_value -
+                    self.rl.storage.get_value(state, action))
+        pair = int(numpy.ravel_multi_index((state, action), self.seen.shape))
+        self.push([pair], [weight * abs(td_error)])
+        self.plan()
+        return td_error
+
+
+class ReplayLearner(Learner):
+
+    """Learner that learns from replayed experience.
+
+    Every transition is stored in a replay buffer (see
+    reply.replay.ReplayBuffer) and each step the wrapped learner is updated
+    with minibatches sampled from it, so every transition is used several
+    times. With a reply.replay.PrioritizedReplayBuffer the updates are
+    scaled by the importance-sampling weights and the priorities are
+    refreshed with the resulting TD errors.
+    """
+
+    def __init__(self, learner, buffer, batch_size=32, updates=1,
+                 min_size=None):
+        """Initialize the learner.
+
+        Arguments:
+        learner -- the QLearner (or subclass) updated with the sampled
+                   transitions.
+        buffer -- the replay buffer.
+
+        Keyword arguments:
+        batch_size -- number of transitions per minibatch.
+        updates -- number of minibatches per step.
+        min_size -- number of transitions to collect before learning starts,
+                    batch_size by default.
+        """
+        self.learner = learner
+        self.buffer = buffer
+        self.batch_size = batch_size
+        self.updates = updates
+        if min_size is None:
+            min_size = batch_size
+        self.min_size = min_size
+        super(ReplayLearner, self).__init__()
+
+    # the agent and the learning rate are those of the wrapped learner
+    @property
+    def rl(self):
+        return self.learner.rl
+
+    @rl.setter
+    def rl(self, rl):
+        self.learner.rl = rl
+
+    @property
+    def alpha(self):
+        return self.learner.alpha
+
+    @alpha.setter
+    def alpha(self, alpha):
+        self.learner.alpha = alpha
+
+    def new_episode(self):
+        """Start a new episode."""
+        super(ReplayLearner, self).new_episode()
+        self.learner.new_episode()
+
+    def update(self, state, action, reward, next_state, done=False,
+               weight=1):
+        """Store the transition and learn from sampled ones.
+
+        Return the TD error of the transition under the values before the
+        sampled updates.
+        """
+        td_error = self.learner.get_td_errors(
+            [state], [action], [reward], [next_state], [done])[0]
+        self.buffer.append(state, action, reward, next_state, done)
+        if len(self.buffer) < self.min_size:
+            return td_error
+        for i in range(self.updates):
+            batch, indices, weights = self.buffer.sample_weighted(
+                self.batch_size)
+            td_errors = self.learner.update_batch(*batch, weights=weights)
+            self.buffer.update_priorities(indices, td_errors)
+        return td_error
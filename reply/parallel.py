@@ -0,0 +1,145 @@
+"""Multi-process training."""
+import multiprocessing
+import Queue
+import random
+import time
+import traceback
+import numpy
+
+__all__ = ["ParallelRunner", "WorkerError"]
+
+
+class WorkerError(Exception):
+
+    """Exception raised when a worker process fails."""
+
+    pass
+
+
+class ParallelRunner(object):
+
+    """Runs several agents in parallel processes that share one storage.
+
+    Each worker process builds its own world and agent around the shared
+    storage, typically a reply.storage.SharedTableStorage or a
+    reply.remote.RemoteStorage, so all of them learn into the same table.
+    The processes are forked, so the storage must be created before calling
+    run.
+    """
+
+    def __init__(self, storage, make_agent, make_world, workers=None,
+                 seed=None):
+        """Initialize the runner.
+
+        Arguments:
+        storage -- the storage shared by all the workers.
+        make_agent -- callable that receives the storage and returns the RL
+                      instance a worker trains.
+        make_world -- callable that returns the World instance of a worker.
+
+        Keyword arguments:
+        workers -- number of worker processes, defaults to the number of
+                   cores.
+        seed -- base seed for the random number generators of the workers.
+                By default they are seeded from the operating system.
+        """
+        self.storage = storage
+        self.make_agent = make_agent
+        self.make_world = make_world
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        self.workers = workers
+        self.seed = seed
+
+    def work(self, worker, episodes, max_steps, results):
+        """Train an agent for a number of episodes, reporting each one.
+
+        If anything fails, a (worker, None, traceback) tuple is reported
+        instead.
+        """
+        try:
+            self.train(worker, episodes, max_steps, results)
+        except Exception:
+            results.put((worker, None, traceback.format_exc()))
+
+    def train(self, worker, episodes, max_steps, results):
+        """Train the agent of a worker, reporting each episode."""
+        if self.seed is None:
+            random.seed()
+            numpy.random.seed()
+        else:
+            random.seed(self.seed + worker)
+            numpy.random.seed(self.seed + worker)
+        agent = self.make_agent(self.storage)
+        world = self.make_world()
+        for episode in range(episodes):
+            total_reward, steps = agent.run(world, max_steps=max_steps)
+            results.put((worker, episode, total_reward, steps))
+        if hasattr(self.storage, 'flush'):
+            # write out what the storage still buffers
+            self.storage.flush()
+
+    def run(self, episodes, max_steps=1000):
+        """Run episodes in each worker and return the aggregated statistics.
+
+        Arguments:
+        episodes -- number of episodes run by each worker.
+
+        Keyword arguments:
+        max_steps -- maximum number of steps of an episode.
+
+        The returned dictionary has the total number of episodes and steps,
+        the mean reward and steps per episode, the throughput in episodes and
+        steps per second, and the list of (worker, episode, total_reward,
+        steps) tuples.
+
+        Raises WorkerError if a worker fails or dies.
+        """
+        results = multiprocessing.Queue()
+        processes = [
+            multiprocessing.Process(target=self.work,
+                                    args=(worker, episodes, max_steps,
+                                          results))
+            for worker in range(self.workers)]
+        start = time.time()
+        for process in processes:
+            process.start()
+        history = []
+        try:
+            while len(history) < self.workers * episodes:
+                try:
+                    result = results.get(timeout=1)
+                except Queue.Empty:
+                    self.check(processes)
+                    continue
+                if result[1] is None:
+                    raise WorkerError('worker %d failed:\n%s' %
+                                      (result[0], result[2]))
+                history.append(result)
+        except:
+            for process in processes:
+                process.terminate()
+            raise
+        finally:
+            for process in processes:
+                process.join()
+        elapsed = time.time() - start
+        rewards = numpy.array([h[2] for h in history], dtype=float)
+        steps = numpy.array([h[3] for h in history], dtype=float)
+        return {
+            'episodes': len(history),
+            'steps': int(steps.sum()),
+            'mean_reward': rewards.mean() if len(history) else 0.0,
+            'mean_steps': steps.mean() if len(history) else 0.0,
+            'elapsed': elapsed,
+            'episodes_per_second': len(history) / elapsed,
+            'steps_per_second': steps.sum() / elapsed,
+            'history': history,
+            }
+
+    def check(self, processes):
+        """Raise WorkerError if a worker died without reporting."""
+        for worker, process in enumerate(processes):
+            if process.exitcode not in (None, 0):
+                raise WorkerError('worker %d exited with code %d' %
+                                  (worker, process.exitcode))
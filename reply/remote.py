@@ -0,0 +1,375 @@
+"""Storage served by another process.
+
+A storage server owns the table and any number of actor processes reach it
+through RemoteStorage clients, over a Unix socket (the address is a path)
+or TCP (the address is a (host, port) tuple).
+
+The protocol is binary: every message is a header with the operation and
+the payload length, followed by the payload.
+
+    GET       int32 states                -> float64 rows
+    WRITE     (int32 state, int32 action,
+               float64 value, uint8 add)  -> no reply
+    DUMP      filename                    -> empty reply
+    SHUTDOWN                              -> empty reply
+
+Writes are never answered, so clients send them in batches without waiting
+and the server applies them in order before any later request of the same
+client.
+"""
+import errno
+import multiprocessing
+import os
+import select
+import socket
+import struct
+import time
+import numpy
+from storage import Storage
+
+__all__ = ["RemoteStorage", "serve", "spawn_server"]
+
+HEADER = struct.Struct('<BI')
+
+GET, WRITE, DUMP, SHUTDOWN = range(1, 5)
+
+WRITE_DTYPE = numpy.dtype([('state', '<i4'), ('action', '<i4'),
+                           ('value', '<f8'), ('add', 'u1')])
+
+
+def create_socket(address):
+    """Return a stream socket of the right family for the address."""
+    if isinstance(address, basestring):
+        return socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return sock
+
+
+def receive(sock, size):
+    """Read exactly size bytes from the socket."""
+    data = bytearray(size)
+    view = memoryview(data)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:], size - received)
+        if not count:
+            raise EOFError('connection closed')
+        received += count
+    return bytes(data)
+
+
+def receive_message(sock):
+    """Read a message and return its (operation, payload)."""
+    operation, length = HEADER.unpack(receive(sock, HEADER.size))
+    return operation, receive(sock, length)
+
+
+def pack_message(operation, payload=''):
+    """Return the bytes of a message."""
+    return HEADER.pack(operation, len(payload)) + payload
+
+
+def handle(storage, operation, payload):
+    """Carry out a request on the storage and return the reply, or None if
+    the request is not answered."""
+    if operation == GET:
+        states = numpy.frombuffer(payload, dtype='<i4')
+        rows = numpy.zeros((len(states), storage.encoder.output_size),
+                           dtype='<f8')
+        for i, state in enumerate(states):
+            rows[i] = storage.get_state_values(state)
+        return rows.tostring()
+    elif operation == WRITE:
+        for state, action, value, add in numpy.frombuffer(payload,
+                                                          dtype=WRITE_DTYPE):
+            if add:
+                storage.update(state, action, value)
+            else:
+                storage.store_value(state, action, value)
+        return None
+    elif operation == DUMP:
+        storage.dump(payload.decode('utf-8'))
+        return ''
+    elif operation == SHUTDOWN:
+        return ''
+    raise ValueError('unknown operation %d' % operation)
+
+
+def serve(storage, address):
+    """Serve a storage until a client asks for a shutdown.
+
+    Arguments:
+    storage -- the storage that owns the values, e.g. a
+               reply.storage.TableStorage.
+    address -- a path for a Unix socket or a (host, port) tuple for TCP.
+    """
+    server = create_socket(address)
+    if isinstance(address, basestring):
+        if os.path.exists(address):
+            os.unlink(address)
+    else:
+        server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(address)
+    server.listen(64)
+    clients = []
+    try:
+        while True:
+            readable = select.select([server] + clients, [], [])[0]
+            for sock in readable:
+                if sock is server:
+                    clients.append(server.accept()[0])
+                    continue
+                try:
+                    operation, payload = receive_message(sock)
+                except (EOFError, socket.error):
+                    clients.remove(sock)
+                    sock.close()
+                    continue
+                reply = handle(storage, operation, payload)
+                if reply is not None:
+                    sock.sendall(pack_message(operation, reply))
+                if operation == SHUTDOWN:
+                    return
+    finally:
+        for sock in clients:
+            sock.close()
+        server.close()
+        if isinstance(address, basestring) and os.path.exists(address):
+            os.unlink(address)
+
+
+def spawn_server(storage, address, timeout=10.0):
+    """Serve a storage from a new local process and return the process.
+
+    The process gets a copy of the storage, which from then on is only
+    changed through RemoteStorage clients. Returns once the server accepts
+    connections.
+
+    Arguments:
+    storage -- the storage that owns the values.
+    address -- a path for a Unix socket or a (host, port) tuple for TCP.
+
+    Keyword arguments:
+    timeout -- seconds to wait for the server to start.
+    """
+    process = multiprocessing.Process(target=serve, args=(storage, address))
+    process.daemon = True
+    process.start()
+    deadline = time.time() + timeout
+    while True:
+        sock = create_socket(address)
+        try:
+            sock.connect(address)
+            return process
+        except socket.error as error:
+            if (error.errno not in (errno.ENOENT, errno.ECONNREFUSED) or
+                    time.time() > deadline or not process.is_alive()):
+                process.terminate()
+                raise
+            time.sleep(0.01)
+        finally:
+            sock.close()
+
+
+class RemoteStorage(Storage):
+
+    """Storage client of a storage server (see serve and spawn_server).
+
+    Writes are applied to the local copy of the row, if it is cached, and
+    queued; the queue is sent in one message every batch_size writes, at
+    the end of every episode and whenever rows are requested. Rows are
+    cached, and every refresh lookups all the cached rows are fetched
+    again in a single request to pick up the writes of other clients.
+
+    The connection is opened on first use and reopened in forked
+    processes, so one instance can be handed to the workers of a
+    reply.parallel.ParallelRunner.
+    """
+
+    def __init__(self, encoder, address, batch_size=256, refresh=1000):
+        """Initialize the storage.
+
+        Arguments:
+        encoder -- encoder used to transform the world coordinates to
+                   rl coordinates.
+        address -- address of the server, a path for a Unix socket or a
+                   (host, port) tuple for TCP.
+
+        Keyword arguments:
+        batch_size -- number of writes queued before they are sent.
+        refresh -- number of lookups between refreshes of the cached rows,
+                   0 to refresh only on refresh calls.
+        """
+        super(RemoteStorage, self).__init__(encoder)
+        self.address = address
+        self.batch_size = batch_size
+        self.refresh_interval = refresh
+        self.sock = None
+        self.pid = os.getpid()
+        self.rows = {}
+        self.pending = []
+        self.lookups = 0
+        self.requests = 0
+
+    def check_fork(self):
+        """Drop the state inherited from the parent in a forked process.
+
+        Called before the cache, the queue or the socket are used, so a
+        child never sends or trusts what belongs to its parent.
+        """
+        if self.pid != os.getpid():
+            self.pid = os.getpid()
+            self.sock = None
+            self.rows = {}
+            self.pending = []
+
+    @property
+    def connection(self):
+        """Return the socket connected to the server."""
+        self.check_fork()
+        if self.sock is None:
+            self.sock = create_socket(self.address)
+            self.sock.connect(self.address)
+        return self.sock
+
+    def request(self, operation, payload=''):
+        """Send the queued writes and a request, and return the reply."""
+        sock = self.connection
+        sock.sendall(self.pack_pending() + pack_message(operation, payload))
+        self.requests += 1
+        return receive_message(sock)[1]
+
+    def pack_pending(self):
+        """Return the message with the queued writes and empty the queue."""
+        if not self.pending:
+            return ''
+        writes = numpy.array(self.pending, dtype=WRITE_DTYPE)
+        self.pending = []
+        return pack_message(WRITE, writes.tostring())
+
+    def flush(self):
+        """Send the queued writes to the server."""
+        self.check_fork()
+        if self.pending:
+            self.connection.sendall(self.pack_pending())
+
+    def close(self):
+        """Send the queued writes and close the connection."""
+        self.check_fork()
+        if self.sock is not None:
+            self.flush()
+            self.sock.close()
+        self.sock = None
+        self.rows = {}
+
+    def shutdown(self):
+        """Stop the server."""
+        self.request(SHUTDOWN)
+        self.close()
+
+    def save(self, filename):
+        """Make the server dump its storage to a file on its host."""
+        self.request(DUMP, filename.encode('utf-8'))
+
+    def get_rows(self, states):
+        """Fetch the rows of many states in one request and cache them.
+
+        Returns an array with one row per state.
+        """
+        states = numpy.asarray(states, dtype='<i4').ravel()
+        rows = self.fetch(states)
+        for state, row in zip(states, rows):
+            self.rows[int(state)] = row
+        return rows
+
+    def fetch(self, states):
+        """Return the rows of the given states as stored by the server."""
+        states = numpy.asarray(states, dtype='<i4').ravel()
+        data = self.request(GET, states.tostring())
+        return numpy.frombuffer(data, dtype='<f8').reshape(
+            len(states), self.encoder.output_size).copy()
+
+    def refresh(self):
+        """Fetch all the cached rows again."""
+        self.check_fork()
+        if self.rows:
+            self.get_rows(sorted(self.rows))
+
+    def get_row(self, state):
+        """Return the cached row of a state, fetching it if needed."""
+        self.check_fork()
+        self.lookups += 1
+        if self.refresh_interval and self.lookups % self.refresh_interval == 0:
+            self.refresh()
+        state = int(state)
+        row = self.rows.get(state)
+        if row is None:
+            row = self.get_rows([state])[0]
+        return row
+
+    def queue(self, state, action, value, add):
+        """Queue a write, sending the queue once it is full."""
+        self.check_fork()
+        self.pending.append((state, action, value, add))
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+
+    def new_episode(self):
+        """Start a new episode, sending the queued writes."""
+        self.flush()
+
+    def store_value(self, state, action, new_value):
+        """Update the (state, action) -> value relationship.
+
+        The parameters are received in rl-encoding.
+        """
+        self.check_fork()
+        row = self.rows.get(int(state))
+        if row is not None:
+            row[action] = new_value
+        self.queue(state, action, new_value, False)
+
+    def update(self, state, action, delta):
+        """Add delta to the value of the (state, action) pair.
+
+        The parameters are received in rl-encoding.
+        """
+        self.check_fork()
+        row = self.rows.get(int(state))
+        if row is not None:
+            row[action] += delta
+        self.queue(state, action, delta, True)
+
+    def get_value(self, state, action):
+        """Return the value for the (state, action) pair.
+
+        The parameters are received in rl-encoding.
+        """
+        return self.get_row(state)[action]
+
+    def get_state_values(self, state):
+        """Return an array of the action values for the give state.
+
+        The parameters are received in rl-encoding.
+        """
+        return self.get_row(state)
+
+    def get_max_value(self, state):
+        """Return the maximum action value for the given state.
+
+        The parameters are received in rl-encoding.
+        """
+        return self.get_row(state).max()
+
+    def dump(self, filename):
+        """Persist the storage to a file.
+
+        The file is written by the server, see save.
+        """
+        self.save(filename)
+
+    def get_arrays(self):
+        """Return a dictionary with the whole table fetched from the
+        server."""
+        return {'state': self.fetch(numpy.arange(self.encoder.input_size))}
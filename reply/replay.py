@@ -0,0 +1,234 @@
+"""Experience replay buffers."""
+import numpy
+
+__all__ = ["ReplayBuffer", "SumTree", "PrioritizedReplayBuffer"]
+
+
+class ReplayBuffer(object):
+
+    """Ring buffer of transitions backed by preallocated numpy arrays.
+
+    Each transition is a (state, action, reward, next_state, done) tuple in
+    rl-encoding. The arrays are allocated on the first append, with the
+    shape and type of the first state, so the buffer works both with
+    integer states and with feature vectors. Once full, the oldest
+    transitions are overwritten.
+    """
+
+    def __init__(self, capacity):
+        """Initialize the buffer.
+
+        Arguments:
+        capacity -- maximum number of transitions kept.
+        """
+        self.capacity = capacity
+        self.size = 0
+        self.position = 0
+        self.states = None
+        self.actions = None
+        self.rewards = None
+        self.next_states = None
+        self.dones = None
+
+    def __len__(self):
+        return self.size
+
+    def allocate(self, state):
+        """Allocate the arrays for states like the given one."""
+        state = numpy.asarray(state)
+        shape = (self.capacity,) + state.shape
+        self.states = numpy.zeros(shape, dtype=state.dtype)
+        self.next_states = numpy.zeros(shape, dtype=state.dtype)
+        self.actions = numpy.zeros(self.capacity, dtype=int)
+        self.rewards = numpy.zeros(self.capacity)
+        self.dones = numpy.zeros(self.capacity, dtype=bool)
+
+    def append(self, state, action, reward, next_state, done=False):
+        """Add a transition, overwriting the oldest one if full.
+
+        Return the position the transition was stored at.
+        """
+        if self.states is None:
+            self.allocate(state)
+        i = self.position
+        self.states[i] = state
+        self.actions[i] = action
+        self.rewards[i] = reward
+        self.next_states[i] = next_state
+        self.dones[i] = done
+        self.position = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        return i
+
+    def get(self, indices):
+        """Return the (states, actions, rewards, next_states, dones) arrays
+        of the transitions at the given positions."""
+        return (self.states[indices], self.actions[indices],
+                self.rewards[indices], self.next_states[indices],
+                self.dones[indices])
+
+    def sample(self, batch_size):
+        """Return a uniformly sampled minibatch of transitions, as arrays
+        (states, actions, rewards, next_states, dones)."""
+        return self.get(numpy.random.randint(0, self.size, batch_size))
+
+    def sample_weighted(self, batch_size):
+        """Return a sampled minibatch with its positions and importance
+        weights, as a (batch, indices, weights) tuple.
+
+        Sampling is uniform, so all the weights are 1.
+        """
+        indices = numpy.random.randint(0, self.size, batch_size)
+        return self.get(indices), indices, numpy.ones(batch_size)
+
+    def update_priorities(self, indices, td_errors):
+        """Set the priorities of sampled transitions from their TD errors.
+
+        Uniform sampling has no priorities, so this does nothing.
+        """
+        pass
+
+    def clear(self):
+        """Forget all the transitions."""
+        self.size = 0
+        self.position = 0
+
+
+class SumTree(object):
+
+    """Binary tree of sums stored in a flat array.
+
+    Leaf i holds the priority of item i and every inner node the sum of its
+    children, so the root holds the total. Finding the item at a given
+    point of the cumulative sum and changing a priority are O(log n), and
+    both work on whole arrays of points or items at once.
+    """
+
+    def __init__(self, capacity):
+        """Initialize the tree.
+
+        Arguments:
+        capacity -- number of items.
+        """
+        self.capacity = capacity
+        # leaves are all at the same depth
+        self.leaves = 1
+        while self.leaves < capacity:
+            self.leaves *= 2
+        self.tree = numpy.zeros(2 * self.leaves)
+
+    @property
+    def total(self):
+        """Return the sum of all the priorities."""
+        return self.tree[1]
+
+    def get(self, indices):
+        """Return the priorities of the given items."""
+        return self.tree[self.leaves + numpy.asarray(indices)]
+
+    def update(self, indices, priorities):
+        """Set the priorities of the given items."""
+        nodes = self.leaves + numpy.asarray(indices, dtype=int).ravel()
+        self.tree[nodes] = priorities
+        tree = self.tree
+        if len(nodes) == 1:
+            # plain python is faster than numpy along a single path
+            node = int(nodes[0]) // 2
+            while node >= 1:
+                tree[node] = tree[2 * node] + tree[2 * node + 1]
+                node //= 2
+            return
+        nodes = numpy.unique(nodes // 2)
+        while nodes[0] >= 1:
+            tree[nodes] = tree[2 * nodes] + tree[2 * nodes + 1]
+            if nodes[0] == 1:
+                break
+            nodes = numpy.unique(nodes // 2)
+
+    def find(self, values):
+        """Return the items at the given points of the cumulative sum."""
+        values = numpy.array(values, dtype=float)
+        nodes = numpy.ones(len(values), dtype=int)
+        while nodes[0] < self.leaves:
+            left = 2 * nodes
+            left_sums = self.tree[left]
+            # rounding must not lead into an empty subtree
+            right = (values >= left_sums) & (self.tree[left + 1] > 0)
+            values -= numpy.where(right, left_sums, 0)
+            nodes = left + right
+        return numpy.minimum(nodes - self.leaves, self.capacity - 1)
+
+
+class PrioritizedReplayBuffer(ReplayBuffer):
+
+    """Replay buffer that samples transitions by the size of their TD error.
+
+    Transition i is sampled with probability p_i ** alpha / sum_k p_k **
+    alpha, where p_i is its last absolute TD error (new transitions get the
+    largest priority seen so far). Since that biases the updates, sampled
+    transitions come with importance-sampling weights (N * P(i)) ** -beta,
+    normalized by the largest one. Priorities are kept in a SumTree.
+    """
+
+    def __init__(self, capacity, alpha=0.6, beta=0.4, beta_increment=0,
+                 epsilon=1e-6):
+        """Initialize the buffer.
+
+        Arguments:
+        capacity -- maximum number of transitions kept.
+
+        Keyword arguments:
+        alpha -- how much prioritization is used, 0 is uniform sampling.
+        beta -- importance-sampling exponent, 1 fully corrects the bias.
+        beta_increment -- amount beta grows each time a batch is sampled,
+                          up to 1.
+        epsilon -- added to the TD errors so every transition can be sampled.
+        """
+        super(PrioritizedReplayBuffer, self).__init__(capacity)
+        self.alpha = alpha
+        self.beta = beta
+        self.beta_increment = beta_increment
+        self.epsilon = epsilon
+        self.priorities = SumTree(capacity)
+        self.max_priority = 1.0
+
+    def append(self, state, action, reward, next_state, done=False):
+        """Add a transition with the maximum priority.
+
+        Return the position the transition was stored at.
+        """
+        i = super(PrioritizedReplayBuffer, self).append(
+            state, action, reward, next_state, done)
+        self.priorities.update([i], self.max_priority ** self.alpha)
+        return i
+
+    def sample(self, batch_size):
+        """Return a prioritized minibatch of transitions, as arrays
+        (states, actions, rewards, next_states, dones)."""
+        return self.sample_weighted(batch_size)[0]
+
+    def sample_weighted(self, batch_size):
+        """Return a prioritized minibatch with its positions and importance
+        weights, as a (batch, indices, weights) tuple."""
+        total = self.priorities.total
+        # one point in each of batch_size equal segments of the total
+        points = (numpy.arange(batch_size) +
+                  numpy.random.random(batch_size)) * (total / batch_size)
+        indices = self.priorities.find(points)
+        probabilities = self.priorities.get(indices) / total
+        weights = (self.size * probabilities) ** -self.beta
+        weights /= weights.max()
+        self.beta = min(1.0, self.beta + self.beta_increment)
+        return self.get(indices), indices, weights
+
+    def update_priorities(self, indices, td_errors):
+        """Set the priorities of sampled transitions from their TD errors."""
+        priorities = numpy.abs(td_errors) + self.epsilon
+        self.max_priority = max(self.max_priority, priorities.max())
+        self.priorities.update(indices, priorities ** self.alpha)
+
+    def clear(self):
+        """Forget all the transitions."""
+        super(PrioritizedReplayBuffer, self).clear()
+        self.priorities = SumTree(self.capacity)
+        self.max_priority = 1.0
@@ -1,7 +1,8 @@
 """Agent and World classes."""
+import math
 import numpy
 
-__all__ = ["dimension", "World", "ActionNotPossible", "RL"]
+__all__ = ["dimension", "Dimension", "World", "ActionNotPossible", "RL"]
 
 def dimension(start, end, points):
     """
@@ -10,14 +11,81 @@ def dimension(start, end, points):
     in the range. The range will have 'points' points.
     """
     if points == 1:
-        return numpy.array([0])
+        return Dimension(numpy.array([0]))
     end = float(end)
     start = float(start)
     step_size = (end - start)/(points-1)
-    d = numpy.zeros(points)
-    for i in range(points):
-        d[i] = start+step_size * i
-    return d
+    d = start + step_size * numpy.arange(points)
+    return Dimension(d, start=start, end=end, step=step_size)
+
+
+class Dimension(numpy.ndarray):
+
+    """Discretization of a problem dimension.
+
+    A Dimension is a numpy array with the points of the discretization, so
+    it can be used anywhere an array of points was expected. When built
+    for an evenly spaced range it remembers its start, end and step, and
+    finds the point nearest to a value in constant time. Otherwise
+    (non-uniform or categorical points) a binary search is used.
+    """
+
+    def __new__(cls, values, start=None, end=None, step=None):
+        obj = numpy.asarray(values).view(cls)
+        obj.start = start
+        obj.end = end
+        obj.step = step
+        return obj
+
+    def __array_finalize__(self, obj):
+        # slices and arithmetic results are treated as arbitrary points
+        self.start = None
+        self.end = None
+        self.step = None
+        self._order = None
+        self._sorted = None
+
+    def __array_wrap__(self, array, context=None):
+        # reductions such as min and max give plain scalars
+        if array.ndim == 0:
+            return array[()]
+        return numpy.ndarray.__array_wrap__(self, array, context)
+
+    def __reduce__(self):
+        return (Dimension,
+                (numpy.asarray(self), self.start, self.end, self.step))
+
+    def index_of(self, value):
+        """Return the index of the point nearest to value."""
+        if self.step:
+            i = int(math.ceil((value - self.start) / self.step - 0.5))
+            return min(max(i, 0), len(self) - 1)
+        return int(self.indices_of(value))
+
+    def indices_of(self, values):
+        """Return the indices of the points nearest to an array of values."""
+        values = numpy.asarray(values, dtype=float)
+        if self.step:
+            i = numpy.ceil((values - self.start) / self.step - 0.5)
+            return numpy.clip(i, 0, len(self) - 1).astype(int)
+        if len(self) == 1:
+            return numpy.zeros(values.shape, dtype=int)
+        if self._sorted is None:
+            points = numpy.asarray(self)
+            self._order = numpy.argsort(points, kind='mergesort')
+            self._sorted = points[self._order]
+        points = self._sorted
+        j = numpy.clip(numpy.searchsorted(points, values), 1, len(points) - 1)
+        # the stable sort puts the lowest original index first among equal
+        # points, so take the first of each run
+        left = self._order[numpy.searchsorted(points, points[j - 1])]
+        right = self._order[numpy.searchsorted(points, points[j])]
+        to_left = values - points[j - 1]
+        to_right = points[j] - values
+        # on ties keep the lowest original index, as a linear scan would
+        return numpy.where(to_left < to_right, left,
+                           numpy.where(to_right < to_left, right,
+                                       numpy.minimum(left, right)))
 
 
 class World(object):
@@ -108,19 +176,22 @@ class RL(object):
             reward = world.get_reward( next_state )
             self.total_reward += reward
 
+            done = bool(world.is_final(next_state))
+
             # perform the learning
             self.learner.update(
                 self.encoded_current_state,
                 self.encoded_action,
                 reward,
                 encoded_next_state,
+                done,
                 )
 
             self.current_state = next_state
             self.encoded_current_state = encoded_next_state
 
             self.total_steps += 1
-            if world.is_final(self.current_state):
+            if done:
                 return False
 
         while True:
@@ -43,7 +43,7 @@ class EGreedySelector(Selector):
         self.epsilon = epsilon
         self.decay = decay
         self.min_epsilon = min_epsilon
-        super(EGreedySelector, self).__init__(self)
+        super(EGreedySelector, self).__init__()
 
     def new_episode(self):
         """Start a new episode."""
@@ -55,13 +55,13 @@ class EGreedySelector(Selector):
         The action returned is the optimal action with probability (1-p),
         and a random action with probability p.
         """
-        action_value_array = self.rl.storage.get_state_values( encoded_state )
+        storage = self.rl.storage
         if random.random() < self.epsilon:
             #print "R",
+            action_value_array = storage.get_state_values( encoded_state )
             action = random.randint(0, numpy.size(action_value_array)-1)
         else:
-            #print action_value_array,
-            action = numpy.argmax( action_value_array )
+            action = storage.get_greedy_action( encoded_state )
         #print action
         return action
 
@@ -77,7 +77,7 @@ class SoftMaxSelector(Selector):
         temperature -- 
         """
         self.temperature = temperature
-        super(SoftMaxSelector, self).__init__(self)
+        super(SoftMaxSelector, self).__init__()
 
     def select_action(self, encoded_state):
         """Return an action.
@@ -88,11 +88,12 @@ class SoftMaxSelector(Selector):
         the action returned is the optimal action according to the
         softmax selection policy.
         """
-        action_value_array = self.rl.storage.get_state_values(encoded_state)
         if self.temperature == 0:
             # this should be absolute greedy selection
-            action = numpy.argmax(action_value_array)
+            action = self.rl.storage.get_greedy_action(encoded_state)
         else:
+            action_value_array = self.rl.storage.get_state_values(
+                encoded_state)
             # get all actions for this state, and their values
             # select a probability
             pr = random.random()
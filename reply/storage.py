@@ -1,5 +1,13 @@
 """Storage classes."""
 import cPickle as pickle
+import heapq
+import mmap
+import multiprocessing
+import os
+import random
+import shutil
+import sqlite3
+import sys
 import numpy
 
 class Storage(object):
@@ -29,6 +37,15 @@ class Storage(object):
         """
         raise NotImplementedError()
 
+    def update(self, state, action, delta):
+        """Add delta to the value of the (state, action) pair.
+
+        Learners update values through this method, which storages can
+        override to do the read-modify-write in one step.
+        The parameters are received in rl-encoding.
+        """
+        self.store_value(state, action, self.get_value(state, action) + delta)
+
     def get_value(self, state, action):
         """Return the value for the (state, action) pair.
 
@@ -50,6 +67,38 @@ class Storage(object):
         """
         raise NotImplementedError()
 
+    def get_greedy_action(self, state):
+        """Return the action with the maximum value for the given state.
+
+        The parameters are received in rl-encoding.
+        """
+        return numpy.argmax(self.get_state_values(state))
+
+    def get_values(self, states, actions):
+        """Return the values of arrays of (state, action) pairs.
+
+        The parameters are received in rl-encoding.
+        """
+        return numpy.array([self.get_value(state, action)
+                            for state, action in zip(states, actions)])
+
+    def get_max_values(self, states):
+        """Return the maximum action values of an array of states.
+
+        The parameters are received in rl-encoding.
+        """
+        return numpy.array([self.get_max_value(state) for state in states])
+
+    def update_values(self, states, actions, deltas):
+        """Add deltas to the values of arrays of (state, action) pairs.
+
+        Repeated pairs get the sum of their deltas. Storages that can
+        should override the one-by-one updates done here.
+        The parameters are received in rl-encoding.
+        """
+        for state, action, delta in zip(states, actions, deltas):
+            self.update(state, action, delta)
+
     def load(self, filename):
         """Retrieve a persisted storage from a file."""
         raise NotImplementedError()
@@ -58,12 +107,37 @@ class Storage(object):
         """Persist the storage to a file."""
         raise NotImplementedError()
 
+    def get_arrays(self):
+        """Return a dictionary with the arrays that hold the storage data.
+
+        Used by reply.checkpoint to persist the storage.
+        """
+        raise NotImplementedError()
+
+    def set_arrays(self, arrays):
+        """Restore the storage data from a dictionary of arrays, as returned
+        by get_arrays."""
+        raise NotImplementedError()
+
+    def get_dirty_rows(self):
+        """Return the states whose values changed since the last call to
+        clear_dirty_rows.
+
+        Only meaningful for storages whose arrays have one row per state.
+        """
+        raise NotImplementedError()
+
+    def clear_dirty_rows(self):
+        """Forget about the changed states."""
+        raise NotImplementedError()
+
 
 class TableStorage(Storage):
     
     """Storage that uses a table for its data."""
 
-    def __init__(self, encoder, mappings=None):
+    def __init__(self, encoder, mappings=None, max_index=True,
+                 dtype=numpy.float64, track_precision=False):
         """Initialize the storage.
         
         Arguments:
@@ -73,24 +147,137 @@ class TableStorage(Storage):
         Keyword arguments:
         mappings -- a dictionary with two keys, True and False, that contain a 
                     set of (state, action) pairs.
+        max_index -- if True keep the maximum value and the greedy action of
+                     every state up to date on each store, so they can be
+                     looked up without scanning the row.
+        dtype -- data type of the values, e.g. numpy.float32 or
+                 numpy.float16 to reduce the table memory.
+        track_precision -- if True keep statistics of the rounding error
+                           introduced by dtype (see precision_report).
         """
         super(TableStorage, self).__init__(encoder)
+        self.dtype = numpy.dtype(dtype)
+        self.track_precision = track_precision
+        self.precision_stores = 0
+        self.precision_loss = 0.0
+        self.max_precision_loss = 0.0
+        self.overflows = 0
+        self.state = self.create_table()
         if mappings is not None:
-            self.state = numpy.zeros((encoder.input_size, encoder.output_size))
             for state, action in mappings.items():
                 encoded_state = self.encoder.encode_state( state )
                 self.state[encoded_state, action] = 1
-        else:
-            #self.state = numpy.random.random((encoder.input_size, 
-            #                                  encoder.output_size))
-            self.state = numpy.zeros((encoder.input_size, encoder.output_size))
+        # states changed since the last checkpoint
+        self.dirty_rows = numpy.zeros(encoder.input_size, dtype=bool)
+        # live snapshots, see snapshot
+        self.snapshots = []
+        self.max_index = max_index
+        self.max_values = self.max_actions = None
+        self.rebuild_max_index()
+
+    def create_table(self):
+        """Return the (input_size, output_size) table for the values."""
+        #return numpy.random.random((self.encoder.input_size, 
+        #                            self.encoder.output_size))
+        return numpy.zeros((self.encoder.input_size, self.encoder.output_size),
+                           dtype=self.dtype)
+
+    def rebuild_max_index(self):
+        """Recompute the maximum value and greedy action of every state."""
+        if self.max_index:
+            self.max_actions = numpy.argmax(self.state, axis=1)
+            self.max_values = self.state[numpy.arange(len(self.state)),
+                                         self.max_actions]
 
     def store_value(self, state, action, new_value):
         """Update the (state, action) -> value relationship.
 
         The parameters are received in rl-encoding.
         """
+        if self.snapshots:
+            self.preserve_rows(state)
         self.state[state, action] = new_value
+        self.dirty_rows[state] = True
+        if self.track_precision:
+            self.check_precision(state, action, new_value)
+        if self.max_actions is None:
+            return
+        # compare what was actually stored
+        new_value = self.state[state, action]
+        best = self.max_actions[state]
+        if action == best:
+            if new_value >= self.max_values[state]:
+                self.max_values[state] = new_value
+            else:
+                # the maximum decreased, look for the new one
+                row = self.state[state]
+                best = row.argmax()
+                self.max_actions[state] = best
+                self.max_values[state] = row[best]
+        elif (new_value > self.max_values[state] or
+              (new_value == self.max_values[state] and action < best)):
+            self.max_actions[state] = action
+            self.max_values[state] = new_value
+
+    def check_precision(self, state, action, new_value):
+        """Account for the error of storing new_value in the table."""
+        stored = float(self.state[state, action])
+        self.precision_stores += 1
+        if numpy.isinf(stored) and not numpy.isinf(new_value):
+            self.overflows += 1
+            return
+        loss = abs(stored - new_value)
+        self.precision_loss += loss
+        if loss > self.max_precision_loss:
+            self.max_precision_loss = loss
+
+    def precision_report(self):
+        """Return a dictionary with the rounding error statistics."""
+        stores = max(self.precision_stores, 1)
+        return {
+            'dtype': self.dtype.name,
+            'stores': self.precision_stores,
+            'overflows': self.overflows,
+            'mean_loss': self.precision_loss / stores,
+            'max_loss': self.max_precision_loss,
+            }
+
+    def snapshot(self):
+        """Return a frozen, read-only view of the current values.
+
+        The snapshot shares the table with the storage: before a row is
+        changed through the storage its old values are copied into every
+        live snapshot, so taking a snapshot is cheap and only changed rows
+        cost memory. The snapshot can be used from another thread while
+        learning goes on, and should be released when no longer needed.
+        """
+        snapshot = TableSnapshot(self)
+        self.snapshots.append(snapshot)
+        return snapshot
+
+    def preserve_rows(self, rows):
+        """Copy the given rows into the live snapshots before a change."""
+        for row in numpy.ravel(rows):
+            for snapshot in self.snapshots:
+                if row not in snapshot.rows:
+                    snapshot.rows[row] = self.state[row].copy()
+
+    def release_snapshots(self):
+        """Leave the old table to the live snapshots.
+
+        Needed before replacing the table with a new array: the snapshots
+        keep reading the old one, which the storage no longer changes.
+        """
+        self.snapshots = []
+
+    def detach_snapshots(self):
+        """Give the live snapshots their own copy of the table.
+
+        Needed before changing the whole table in place.
+        """
+        for snapshot in self.snapshots:
+            snapshot.table = snapshot.table.copy()
+        self.snapshots = []
 
     def get_value(self, state, action):
         """Return the value for the (state, action) pair.
@@ -104,7 +291,18 @@ class TableStorage(Storage):
 
         The parameters are received in rl-encoding.
         """
-        return max(self.state[ state ])
+        if self.max_values is not None:
+            return self.max_values[state]
+        return self.state[state].max()
+
+    def get_greedy_action(self, state):
+        """Return the action with the maximum value for the given state.
+
+        The parameters are received in rl-encoding.
+        """
+        if self.max_actions is not None:
+            return self.max_actions[state]
+        return self.state[state].argmax()
 
     def get_state_values(self, state):
         """Return an array of the action values for the give state.
@@ -113,16 +311,1058 @@ class TableStorage(Storage):
         """
         return self.state[ state ]
 
+    def get_values(self, states, actions):
+        """Return the values of arrays of (state, action) pairs.
+
+        The parameters are received in rl-encoding.
+        """
+        return self.state[states, actions]
+
+    def get_max_values(self, states):
+        """Return the maximum action values of an array of states.
+
+        The parameters are received in rl-encoding.
+        """
+        if self.max_values is not None:
+            return self.max_values[states]
+        return self.state[states].max(axis=1)
+
+    def update_values(self, states, actions, deltas):
+        """Add deltas to the values of arrays of (state, action) pairs.
+
+        Repeated pairs get the sum of their deltas.
+        The parameters are received in rl-encoding.
+        """
+        if self.track_precision:
+            return super(TableStorage, self).update_values(states, actions,
+                                                           deltas)
+        states = numpy.asarray(states)
+        rows = numpy.unique(states)
+        if self.snapshots:
+            self.preserve_rows(rows)
+        numpy.add.at(self.state, (states, actions), deltas)
+        self.dirty_rows[rows] = True
+        if self.max_actions is not None:
+            self.max_actions[rows] = self.state[rows].argmax(axis=1)
+            self.max_values[rows] = self.state[rows, self.max_actions[rows]]
+
     def load(self, filename):
         """Retrieve a persisted storage from a file."""
         handler = open(filename, 'rb')
-        self.state = pickle.load(handler)
+        self.release_snapshots()
+        self.state = numpy.asarray(pickle.load(handler), dtype=self.dtype)
+        self.rebuild_max_index()
 
     def dump(self, filename):
         """Persist the storage to a file."""
         handler = open(filename, 'wb')
         pickle.dump(self.state, handler)
 
+    def get_arrays(self):
+        """Return a dictionary with the arrays that hold the storage data."""
+        return {'state': self.state}
+
+    def set_arrays(self, arrays):
+        """Restore the storage data from a dictionary of arrays."""
+        self.release_snapshots()
+        self.state = numpy.array(arrays['state'], dtype=self.dtype)
+        self.rebuild_max_index()
+
+    def get_dirty_rows(self):
+        """Return the states whose values changed since the last call to
+        clear_dirty_rows."""
+        return numpy.flatnonzero(self.dirty_rows)
+
+    def clear_dirty_rows(self):
+        """Forget about the changed states."""
+        self.dirty_rows[:] = False
+
+
+class TableSnapshot(Storage):
+
+    """Frozen, read-only view of the values of a TableStorage.
+
+    Created with TableStorage.snapshot. Rows not changed since the snapshot
+    was taken are read from the live table, changed ones from the copies
+    the storage saved before changing them. Only changes made through the
+    storage object are seen, so with a SharedTableStorage changes made by
+    other processes show through.
+
+    Multi-index states (as used by TileCodingStorage) add up their rows.
+    """
+
+    def __init__(self, storage):
+        """Initialize the snapshot.
+
+        Arguments:
+        storage -- the TableStorage to take the snapshot of.
+        """
+        super(TableSnapshot, self).__init__(storage.encoder)
+        self.storage = storage
+        self.table = storage.state
+        # old values of the rows changed after the snapshot was taken
+        self.rows = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    def release(self):
+        """Stop tracking the changes of the storage."""
+        if self in self.storage.snapshots:
+            self.storage.snapshots.remove(self)
+
+    def get_row(self, row):
+        """Return a copy of the values of a table row."""
+        values = self.rows.get(row)
+        if values is None:
+            values = self.table[row].copy()
+            # the row may have been saved and changed while copying it
+            values = self.rows.get(row, values)
+        return values
+
+    def store_value(self, state, action, new_value):
+        """Snapshots are read-only."""
+        raise TypeError("snapshots are read-only")
+
+    def get_value(self, state, action):
+        """Return the value for the (state, action) pair.
+
+        The parameters are received in rl-encoding.
+        """
+        return self.get_state_values(state)[action]
+
+    def get_state_values(self, state):
+        """Return an array of the action values for the give state.
+
+        The parameters are received in rl-encoding.
+        """
+        if numpy.ndim(state):
+            return sum(self.get_row(row) for row in state)
+        return self.get_row(state)
+
+    def get_max_value(self, state):
+        """Return the maximum action value for the given state.
+
+        The parameters are received in rl-encoding.
+        """
+        return self.get_state_values(state).max()
+
+    def get_arrays(self):
+        """Return a dictionary with the arrays of the frozen values."""
+        table = self.table.copy()
+        for row, values in self.rows.items():
+            table[row] = values
+        return {'state': table}
+
+
+class TileCodingStorage(TableStorage):
+
+    """Storage for states encoded as several active features.
+
+    Meant for encoders such as reply.encoder.TileCodingEncoder, whose
+    rl-encoded states are arrays of feature indices. The table holds one
+    row per feature and the value of a (state, action) pair is the sum of
+    the entries of its active features, so memory is bounded by the number
+    of features rather than by the size of the state space.
+    """
+
+    def __init__(self, encoder, mappings=None, dtype=numpy.float64):
+        """Initialize the storage.
+        
+        Arguments:
+        encoder -- encoder used to transform the world coordinates to 
+                   rl coordinates. 
+
+        Keyword arguments:
+        mappings -- a dictionary with two keys, True and False, that contain a 
+                    set of (state, action) pairs.
+        dtype -- data type of the values.
+        """
+        # rows are features, so there is no per-state maximum to keep
+        super(TileCodingStorage, self).__init__(encoder, mappings=mappings,
+                                                max_index=False, dtype=dtype)
+
+    def store_value(self, state, action, new_value):
+        """Update the (state, action) -> value relationship.
+
+        The change is split evenly among the active features.
+        """
+        delta = (new_value - self.get_value(state, action)) / len(state)
+        if self.snapshots:
+            self.preserve_rows(state)
+        self.state[state, action] += delta
+        self.dirty_rows[state] = True
+
+    def get_value(self, state, action):
+        """Return the value for the (state, action) pair.
+
+        The parameters are received in rl-encoding.
+        """
+        return self.state[state, action].sum()
+
+    def get_max_value(self, state):
+        """Return the maximum action value for the given state.
+
+        The parameters are received in rl-encoding.
+        """
+        return self.get_state_values(state).max()
+
+    def get_greedy_action(self, state):
+        """Return the action with the maximum value for the given state.
+
+        The parameters are received in rl-encoding.
+        """
+        return self.get_state_values(state).argmax()
+
+    def get_state_values(self, state):
+        """Return an array of the action values for the give state.
+
+        The parameters are received in rl-encoding.
+        """
+        return self.state[state].sum(axis=0)
+
+    def get_values(self, states, actions):
+        """Return the values of arrays of (state, action) pairs.
+
+        The parameters are received in rl-encoding.
+        """
+        actions = numpy.asarray(actions)
+        return self.state[states, actions[:, numpy.newaxis]].sum(axis=1)
+
+    def get_max_values(self, states):
+        """Return the maximum action values of an array of states.
+
+        The parameters are received in rl-encoding.
+        """
+        return self.state[states].sum(axis=1).max(axis=1)
+
+    def update_values(self, states, actions, deltas):
+        """Add deltas to the values of arrays of (state, action) pairs.
+
+        Each delta is split evenly among the active features.
+        The parameters are received in rl-encoding.
+        """
+        states = numpy.asarray(states)
+        actions = numpy.asarray(actions)
+        rows = numpy.unique(states)
+        if self.snapshots:
+            self.preserve_rows(rows)
+        deltas = numpy.asarray(deltas, dtype=float) / states.shape[1]
+        numpy.add.at(self.state, (states, actions[:, numpy.newaxis]),
+                     deltas[:, numpy.newaxis])
+        self.dirty_rows[rows] = True
+
+
+class SparseTableStorage(Storage):
+
+    """Storage that uses a table whose rows are allocated on first write.
+
+    States that were never updated share a single read-only row of zeros, so
+    memory grows with the number of visited states instead of with the size
+    of the state space.
+    """
+
+    def __init__(self, encoder, mappings=None, dtype=numpy.float64):
+        """Initialize the storage.
+        
+        Arguments:
+        encoder -- encoder used to transform the world coordinates to 
+                   rl coordinates. 
+
+        Keyword arguments:
+        mappings -- a dictionary with two keys, True and False, that contain a 
+                    set of (state, action) pairs.
+        dtype -- data type of the values.
+        """
+        super(SparseTableStorage, self).__init__(encoder)
+        self.dtype = numpy.dtype(dtype)
+        self.rows = {}
+        self.default_row = numpy.zeros(encoder.output_size, dtype=self.dtype)
+        self.default_row.flags.writeable = False
+        if mappings is not None:
+            for state, action in mappings.items():
+                encoded_state = self.encoder.encode_state( state )
+                self.store_value(encoded_state, action, 1)
+
+    @property
+    def visited_states(self):
+        """Return the number of states that have an allocated row."""
+        return len(self.rows)
+
+    def memory_usage(self):
+        """Return the approximate number of bytes used by the table."""
+        return (sys.getsizeof(self.rows) + sys.getsizeof(self.default_row) +
+                sum(sys.getsizeof(row) for row in self.rows.itervalues()))
+
+    def store_value(self, state, action, new_value):
+        """Update the (state, action) -> value relationship.
+
+        The parameters are received in rl-encoding.
+        """
+        try:
+            row = self.rows[state]
+        except KeyError:
+            row = self.rows[state] = self.default_row.copy()
+        row[action] = new_value
+
+    def get_value(self, state, action):
+        """Return the value for the (state, action) pair.
+
+        The parameters are received in rl-encoding.
+        """
+        return self.rows.get(state, self.default_row)[action]
+
+    def get_max_value(self, state):
+        """Return the maximum action value for the given state.
+
+        The parameters are received in rl-encoding.
+        """
+        return self.rows.get(state, self.default_row).max()
+
+    def get_state_values(self, state):
+        """Return an array of the action values for the give state.
+
+        The parameters are received in rl-encoding.
+        """
+        return self.rows.get(state, self.default_row)
+
+    def load(self, filename):
+        """Retrieve a persisted storage from a file."""
+        handler = open(filename, 'rb')
+        self.rows = dict((state, numpy.asarray(row, dtype=self.dtype))
+                         for state, row in pickle.load(handler).iteritems())
+
+    def dump(self, filename):
+        """Persist the storage to a file."""
+        handler = open(filename, 'wb')
+        pickle.dump(self.rows, handler, pickle.HIGHEST_PROTOCOL)
+
+    def get_arrays(self):
+        """Return a dictionary with the arrays that hold the storage data."""
+        states = numpy.array(sorted(self.rows), dtype=int)
+        rows = numpy.zeros((len(states), self.encoder.output_size),
+                           dtype=self.dtype)
+        for i, state in enumerate(states):
+            rows[i] = self.rows[state]
+        return {'states': states, 'rows': rows}
+
+    def set_arrays(self, arrays):
+        """Restore the storage data from a dictionary of arrays."""
+        rows = numpy.asarray(arrays['rows'], dtype=self.dtype)
+        self.rows = dict(zip(arrays['states'].tolist(), rows))
+
+
+class MemmapTableStorage(TableStorage):
+
+    """Storage that keeps its table in a memory-mapped file.
+
+    Opening the storage does not read the table: pages are loaded on demand
+    and several processes opening the same file read-only share the
+    operating system page cache. Changes reach the file when flush is
+    called (or when the operating system decides to write them back).
+    """
+
+    def __init__(self, encoder, filename, mode=None, mappings=None,
+                 max_index=False, dtype=numpy.float64):
+        """Initialize the storage.
+        
+        Arguments:
+        encoder -- encoder used to transform the world coordinates to 
+                   rl coordinates. 
+        filename -- name of the file holding the table.
+
+        Keyword arguments:
+        mode -- 'r' to open an existing table read-only, 'r+' to open it for
+                writing, 'w+' to create a new table, or 'c' to write changes
+                to memory only. Defaults to 'r+' if the file exists and to
+                'w+' otherwise.
+        mappings -- a dictionary with two keys, True and False, that contain a 
+                    set of (state, action) pairs.
+        max_index -- if True keep the maximum value and greedy action of every
+                     state in memory. Building it reads the whole table, so
+                     it is disabled by default.
+        dtype -- data type of the values. The file holds raw values, so a
+                 table must always be opened with the dtype it was created
+                 with.
+        """
+        if mode is None:
+            mode = 'r+' if os.path.exists(filename) else 'w+'
+        self.filename = filename
+        self.mode = mode
+        super(MemmapTableStorage, self).__init__(encoder, mappings=mappings,
+                                                 max_index=max_index,
+                                                 dtype=dtype)
+
+    def create_table(self):
+        """Return the (input_size, output_size) table for the values."""
+        return numpy.memmap(self.filename, dtype=self.dtype, mode=self.mode,
+                            shape=(self.encoder.input_size,
+                                   self.encoder.output_size))
+
+    def flush(self):
+        """Write the pending changes to the file."""
+        if self.mode in ('r+', 'w+'):
+            self.state.flush()
+
+    def load(self, filename):
+        """Map the table stored in another file."""
+        self.flush()
+        self.filename = filename
+        if self.mode == 'w+':
+            self.mode = 'r+'
+        self.release_snapshots()
+        self.state = self.create_table()
+        self.rebuild_max_index()
+
+    def dump(self, filename):
+        """Persist the storage to a file."""
+        self.flush()
+        if os.path.abspath(filename) != os.path.abspath(self.filename):
+            shutil.copyfile(self.filename, filename)
+
+    def set_arrays(self, arrays):
+        """Restore the storage data from a dictionary of arrays.
+
+        The values are copied into the mapped file.
+        """
+        self.detach_snapshots()
+        self.state[:] = arrays['state']
+        self.rebuild_max_index()
+
+
+class SharedTableStorage(TableStorage):
+
+    """Storage that keeps its table in anonymous shared memory.
+
+    Processes forked after the storage is created (see
+    reply.parallel.ParallelRunner) all read and update the same table.
+    By default updates are lock-free, Hogwild style: concurrent updates of
+    the same value may occasionally be lost, which learning tolerates well.
+    With locks, updates are serialized per group of rows.
+
+    The maximum value index is not kept, since other processes change the
+    rows behind its back, and changed rows are only tracked per process.
+    """
+
+    def __init__(self, encoder, mappings=None, dtype=numpy.float64, locks=0):
+        """Initialize the storage.
+        
+        Arguments:
+        encoder -- encoder used to transform the world coordinates to 
+                   rl coordinates. 
+
+        Keyword arguments:
+        mappings -- a dictionary with two keys, True and False, that contain a 
+                    set of (state, action) pairs.
+        dtype -- data type of the values.
+        locks -- number of striped row locks, 0 for lock-free updates.
+        """
+        super(SharedTableStorage, self).__init__(encoder, mappings=mappings,
+                                                 max_index=False, dtype=dtype)
+        self.locks = [multiprocessing.Lock() for i in range(locks)]
+
+    def create_table(self):
+        """Return the (input_size, output_size) table for the values."""
+        shape = (self.encoder.input_size, self.encoder.output_size)
+        size = shape[0] * shape[1]
+        # anonymous mappings are shared with forked children
+        self.buffer = mmap.mmap(-1, max(1, size * self.dtype.itemsize))
+        table = numpy.frombuffer(self.buffer, dtype=self.dtype, count=size)
+        return table.reshape(shape)
+
+    def store_value(self, state, action, new_value):
+        """Update the (state, action) -> value relationship.
+
+        The parameters are received in rl-encoding.
+        """
+        if self.snapshots:
+            self.preserve_rows(state)
+        if self.locks:
+            with self.locks[state % len(self.locks)]:
+                self.state[state, action] = new_value
+        else:
+            self.state[state, action] = new_value
+        self.dirty_rows[state] = True
+
+    def update(self, state, action, delta):
+        """Add delta to the value of the (state, action) pair.
+
+        The parameters are received in rl-encoding.
+        """
+        if self.snapshots:
+            self.preserve_rows(state)
+        if self.locks:
+            with self.locks[state % len(self.locks)]:
+                self.state[state, action] += delta
+        else:
+            self.state[state, action] += delta
+        self.dirty_rows[state] = True
+
+    def update_values(self, states, actions, deltas):
+        """Add deltas to the values of arrays of (state, action) pairs.
+
+        With locks the pairs are updated one by one.
+        The parameters are received in rl-encoding.
+        """
+        if self.locks:
+            return Storage.update_values(self, states, actions, deltas)
+        super(SharedTableStorage, self).update_values(states, actions, deltas)
+
+    def load(self, filename):
+        """Retrieve a persisted storage from a file into shared memory."""
+        handler = open(filename, 'rb')
+        self.detach_snapshots()
+        self.state[:] = pickle.load(handler)
+
+    def set_arrays(self, arrays):
+        """Restore the storage data from a dictionary of arrays.
+
+        The values are copied into shared memory.
+        """
+        self.detach_snapshots()
+        self.state[:] = arrays['state']
+
+class SQLiteStorage(Storage):
+
+    """Storage that keeps its rows in an SQLite database.
+
+    Every state that was ever written has a row in the 'rows' table, with
+    its action values as a blob of raw little-endian values of the storage
+    dtype, so the values survive crashes and can be read by other tools.
+    The most recently used rows are kept in memory: reads and writes go to
+    the cached rows, and changed rows are written back in one transaction
+    every flush_every updates, when they leave the cache and on flush.
+    When the cache is full the least recently used eighth of it is
+    dropped at once, which keeps lookups of cached rows as cheap as a
+    dictionary access.
+    """
+
+    def __init__(self, encoder, filename, cache_size=10000, flush_every=1000,
+                 dtype=numpy.float64):
+        """Initialize the storage.
+
+        Arguments:
+        encoder -- encoder used to transform the world coordinates to
+                   rl coordinates.
+        filename -- name of the database file, created if needed.
+
+        Keyword arguments:
+        cache_size -- maximum number of rows kept in memory.
+        flush_every -- number of updates between transactions.
+        dtype -- data type of the values. A database must always be opened
+                 with the dtype it was created with.
+        """
+        super(SQLiteStorage, self).__init__(encoder)
+        self.dtype = numpy.dtype(dtype).newbyteorder('<')
+        self.cache_size = cache_size
+        self.flush_every = flush_every
+        self.cache = {}
+        # time of the last use of every cached row
+        self.used = {}
+        self.clock = 0
+        self.dirty = set()
+        self.updates = 0
+        self.hits = 0
+        self.misses = 0
+        self.default_row = numpy.zeros(encoder.output_size, dtype=self.dtype)
+        self.connection = None
+        self.open(filename)
+
+    def open(self, filename):
+        """Open a database, creating its tables if needed."""
+        connection = sqlite3.connect(filename)
+        connection.execute('CREATE TABLE IF NOT EXISTS rows '
+                           '(state INTEGER PRIMARY KEY, value BLOB NOT NULL)')
+        connection.execute('CREATE TABLE IF NOT EXISTS info '
+                           '(key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+        info = {'actions': str(self.encoder.output_size),
+                'dtype': self.dtype.str}
+        stored = dict(connection.execute('SELECT key, value FROM info'))
+        for key, value in info.items():
+            if stored.setdefault(key, value) != value:
+                connection.close()
+                raise ValueError('%s has %s %s, expected %s' %
+                                 (filename, key, stored[key], value))
+        connection.executemany('INSERT OR IGNORE INTO info VALUES (?, ?)',
+                               info.items())
+        connection.commit()
+        self.filename = filename
+        self.connection = connection
+
+    def close(self):
+        """Write the changed rows and close the database."""
+        self.flush()
+        self.connection.close()
+        self.connection = None
+        self.cache.clear()
+        self.used.clear()
+
+    def flush(self):
+        """Write the changed rows to the database in one transaction."""
+        if self.dirty:
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO rows VALUES (?, ?)',
+                [(state, sqlite3.Binary(self.cache[state].tostring()))
+                 for state in self.dirty])
+            self.dirty.clear()
+        self.connection.commit()
+
+    def read_row(self, state):
+        """Return the row of a state as stored in the database."""
+        result = self.connection.execute(
+            'SELECT value FROM rows WHERE state = ?', (state,)).fetchone()
+        if result is None:
+            return self.default_row.copy()
+        return numpy.frombuffer(result[0], dtype=self.dtype).copy()
+
+    def get_row(self, state):
+        """Return the cached row of a state, reading it if needed."""
+        state = int(state)
+        row = self.cache.get(state)
+        if row is None:
+            self.misses += 1
+            if len(self.cache) >= self.cache_size:
+                self.evict(max(1, self.cache_size // 8))
+            row = self.cache[state] = self.read_row(state)
+        else:
+            self.hits += 1
+        self.clock += 1
+        self.used[state] = self.clock
+        return row
+
+    def evict(self, count):
+        """Drop the least recently used rows, writing those that changed."""
+        states = heapq.nsmallest(count, self.used, key=self.used.get)
+        changed = []
+        for state in states:
+            row = self.cache.pop(state)
+            del self.used[state]
+            if state in self.dirty:
+                self.dirty.remove(state)
+                changed.append((state, sqlite3.Binary(row.tostring())))
+        # committed with the next flush
+        self.connection.executemany(
+            'INSERT OR REPLACE INTO rows VALUES (?, ?)', changed)
+
+    def changed(self, state):
+        """Account for an update of a cached row."""
+        self.dirty.add(int(state))
+        self.updates += 1
+        if self.updates % self.flush_every == 0:
+            self.flush()
+
+    def store_value(self, state, action, new_value):
+        """Update the (state, action) -> value relationship.
+
+        The parameters are received in rl-encoding.
+        """
+        self.get_row(state)[action] = new_value
+        self.changed(state)
+
+    def update(self, state, action, delta):
+        """Add delta to the value of the (state, action) pair.
+
+        The parameters are received in rl-encoding.
+        """
+        self.get_row(state)[action] += delta
+        self.changed(state)
+
+    def get_value(self, state, action):
+        """Return the value for the (state, action) pair.
+
+        The parameters are received in rl-encoding.
+        """
+        return self.get_row(state)[action]
+
+    def get_max_value(self, state):
+        """Return the maximum action value for the given state.
+
+        The parameters are received in rl-encoding.
+        """
+        return self.get_row(state).max()
+
+    def get_state_values(self, state):
+        """Return an array of the action values for the give state.
+
+        The parameters are received in rl-encoding.
+        """
+        return self.get_row(state)
+
+    @property
+    def stored_states(self):
+        """Return the number of states that have a row in the database."""
+        self.flush()
+        result = self.connection.execute('SELECT COUNT(*) FROM rows')
+        return result.fetchone()[0]
+
+    def load(self, filename):
+        """Open the storage kept in another database."""
+        self.close()
+        self.open(filename)
+
+    def dump(self, filename):
+        """Persist the storage to a file."""
+        self.flush()
+        if os.path.abspath(filename) != os.path.abspath(self.filename):
+            shutil.copyfile(self.filename, filename)
+
+    def get_arrays(self):
+        """Return a dictionary with the arrays that hold the storage data."""
+        self.flush()
+        result = self.connection.execute(
+            'SELECT state, value FROM rows ORDER BY state').fetchall()
+        states = numpy.array([state for state, value in result], dtype=int)
+        rows = numpy.zeros((len(states), self.encoder.output_size),
+                           dtype=self.dtype)
+        for i, (state, value) in enumerate(result):
+            rows[i] = numpy.frombuffer(value, dtype=self.dtype)
+        return {'states': states, 'rows': rows}
+
+    def set_arrays(self, arrays):
+        """Restore the storage data from a dictionary of arrays."""
+        rows = numpy.asarray(arrays['rows'], dtype=self.dtype)
+        self.cache.clear()
+        self.used.clear()
+        self.dirty.clear()
+        self.connection.execute('DELETE FROM rows')
+        self.connection.executemany(
+            'INSERT INTO rows VALUES (?, ?)',
+            [(int(state), sqlite3.Binary(row.tostring()))
+             for state, row in zip(arrays['states'], rows)])
+        self.connection.commit()
+
+
+class LinearStorage(Storage):
+
+    """Storage that approximates the values with a linear function.
+
+    Holds one weight per (feature, action) pair and computes the value of a
+    state as the dot product of its features with the weights of the
+    action, so memory grows with the number of features instead of with the
+    size of the state space. A rl-encoded state is either a feature vector
+    of input_size floats (see reply.encoder.ScalingEncoder) or an array of
+    indices of active binary features (see
+    reply.encoder.TileCodingEncoder).
+    """
+
+    def __init__(self, encoder, dtype=numpy.float64):
+        """Initialize the storage.
+        
+        Arguments:
+        encoder -- encoder used to transform the world coordinates to 
+                   rl coordinates. 
+
+        Keyword arguments:
+        dtype -- data type of the weights.
+        """
+        super(LinearStorage, self).__init__(encoder)
+        self.dtype = numpy.dtype(dtype)
+        self.weights = numpy.zeros((encoder.input_size, encoder.output_size),
+                                   dtype=self.dtype)
+
+    def update(self, state, action, delta):
+        """Move the value of the (state, action) pair by delta.
+
+        This is a gradient step on the weights of the action, normalized by
+        the squared norm of the features so that the value changes by delta,
+        as it would in a table.
+        The parameters are received in rl-encoding.
+        """
+        features = numpy.asarray(state)
+        if features.dtype.kind in 'iu':
+            self.weights[features, action] += delta / float(len(features))
+        else:
+            norm = features.dot(features)
+            if norm > 0:
+                self.weights[:, action] += (delta / norm) * features
+
+    def store_value(self, state, action, new_value):
+        """Update the (state, action) -> value relationship.
+
+        The parameters are received in rl-encoding.
+        """
+        self.update(state, action, new_value - self.get_value(state, action))
+
+    def get_value(self, state, action):
+        """Return the value for the (state, action) pair.
+
+        The parameters are received in rl-encoding.
+        """
+        features = numpy.asarray(state)
+        if features.dtype.kind in 'iu':
+            return self.weights[features, action].sum()
+        return features.dot(self.weights[:, action])
+
+    def get_state_values(self, state):
+        """Return an array of the action values for the give state.
+
+        The parameters are received in rl-encoding.
+        """
+        features = numpy.asarray(state)
+        if features.dtype.kind in 'iu':
+            return self.weights[features].sum(axis=0)
+        return features.dot(self.weights)
+
+    def get_max_value(self, state):
+        """Return the maximum action value for the given state.
+
+        The parameters are received in rl-encoding.
+        """
+        return self.get_state_values(state).max()
+
+    def load(self, filename):
+        """Retrieve a persisted storage from a file."""
+        handler = open(filename, 'rb')
+        self.weights = numpy.asarray(pickle.load(handler), dtype=self.dtype)
+
+    def dump(self, filename):
+        """Persist the storage to a file."""
+        handler = open(filename, 'wb')
+        pickle.dump(self.weights, handler, pickle.HIGHEST_PROTOCOL)
+
+    def get_arrays(self):
+        """Return a dictionary with the arrays that hold the storage data."""
+        return {'weights': self.weights}
+
+    def set_arrays(self, arrays):
+        """Restore the storage data from a dictionary of arrays."""
+        self.weights = numpy.asarray(arrays['weights'], dtype=self.dtype)
+
+
+class MLPStorage(Storage):
+
+    """Storage that approximates the values with a multilayer perceptron.
+
+    The network maps a feature vector (see reply.encoder.ScalingEncoder) to
+    the values of all the actions in one forward pass. Hidden layers use
+    rectified linear units and the output layer is linear.
+
+    Values stored by the learner are used as regression targets: they are
+    collected into minibatches and the network is trained on each full
+    batch with plain SGD or Adam. Since the network already averages over
+    updates, learners are best used with alpha = 1 and the step size
+    controlled with learning_rate.
+
+    When target_update is set, a copy of the network refreshed every
+    target_update training steps is used for get_max_value, i.e. for the
+    bootstrapped values of the learners, which keeps the targets stable.
+    """
+
+    def __init__(self, encoder, hidden=(32,), learning_rate=0.001,
+                 batch_size=32, optimizer='adam', target_update=None,
+                 seed=None):
+        """Initialize the storage.
+        
+        Arguments:
+        encoder -- encoder used to transform the world coordinates to 
+                   rl coordinates. 
+
+        Keyword arguments:
+        hidden -- sizes of the hidden layers.
+        learning_rate -- step size of the optimizer.
+        batch_size -- number of stored values per training step.
+        optimizer -- 'adam' or 'sgd'.
+        target_update -- number of training steps between copies of the
+                         target network, None to bootstrap from the
+                         network being trained.
+        seed -- seed for the weight initialization.
+        """
+        super(MLPStorage, self).__init__(encoder)
+        if optimizer not in ('adam', 'sgd'):
+            raise ValueError("unknown optimizer %r" % optimizer)
+        self.learning_rate = learning_rate
+        self.batch_size = batch_size
+        self.optimizer = optimizer
+        self.target_update = target_update
+        rng = numpy.random.RandomState(seed)
+        sizes = [encoder.input_size] + list(hidden) + [encoder.output_size]
+        # weights and biases of each layer, alternated
+        self.params = []
+        for n_in, n_out in zip(sizes[:-1], sizes[1:]):
+            self.params.append(rng.randn(n_in, n_out) * numpy.sqrt(2.0/n_in))
+            self.params.append(numpy.zeros(n_out))
+        self.moments = [numpy.zeros_like(p) for p in self.params]
+        self.velocities = [numpy.zeros_like(p) for p in self.params]
+        self.target_params = [p.copy() for p in self.params]
+        self.train_steps = 0
+        # pending minibatch
+        self.batch_states = numpy.zeros((batch_size, encoder.input_size))
+        self.batch_actions = numpy.zeros(batch_size, dtype=int)
+        self.batch_targets = numpy.zeros(batch_size)
+        self.batch_count = 0
+
+    def forward(self, states, params=None):
+        """Return the action values for an (N, input_size) array of states."""
+        if params is None:
+            params = self.params
+        values = states
+        last = len(params) - 2
+        for i in range(0, len(params), 2):
+            values = values.dot(params[i]) + params[i+1]
+            if i != last:
+                values = numpy.maximum(values, 0)
+        return values
+
+    def train_batch(self, states, actions, targets):
+        """Do one training step towards the target values of a minibatch.
+
+        Arguments:
+        states -- (N, input_size) array of rl-encoded states.
+        actions -- array of N actions.
+        targets -- array of N target values.
+
+        Return the mean squared error of the batch before the step.
+        """
+        states = numpy.asarray(states, dtype=float)
+        n = len(states)
+        # forward pass keeping the activations
+        activations = [states]
+        last = len(self.params) - 2
+        for i in range(0, len(self.params), 2):
+            values = activations[-1].dot(self.params[i]) + self.params[i+1]
+            if i != last:
+                values = numpy.maximum(values, 0)
+            activations.append(values)
+        rows = numpy.arange(n)
+        errors = values[rows, actions] - targets
+        # only the outputs of the taken actions have an error
+        delta = numpy.zeros_like(values)
+        delta[rows, actions] = errors / n
+        grads = [None] * len(self.params)
+        for i in range(last, -1, -2):
+            grads[i] = activations[i//2].T.dot(delta)
+            grads[i+1] = delta.sum(axis=0)
+            if i:
+                delta = delta.dot(self.params[i].T) * (activations[i//2] > 0)
+        self.apply_gradients(grads)
+        self.train_steps += 1
+        if self.target_update and self.train_steps % self.target_update == 0:
+            self.target_params = [p.copy() for p in self.params]
+        return (errors**2).mean()
+
+    def apply_gradients(self, grads):
+        """Update the parameters with the optimizer."""
+        if self.optimizer == 'sgd':
+            for param, grad in zip(self.params, grads):
+                param -= self.learning_rate * grad
+            return
+        beta1, beta2, eps = 0.9, 0.999, 1e-8
+        t = self.train_steps + 1
+        rate = (self.learning_rate * numpy.sqrt(1 - beta2**t) /
+                (1 - beta1**t))
+        for param, grad, m, v in zip(self.params, grads, self.moments,
+                                     self.velocities):
+            m *= beta1
+            m += (1 - beta1) * grad
+            v *= beta2
+            v += (1 - beta2) * grad**2
+            param -= rate * m / (numpy.sqrt(v) + eps)
+
+    def store_value(self, state, action, new_value):
+        """Update the (state, action) -> value relationship.
+
+        The value is added to the pending minibatch, which is trained on
+        once it is full.
+        The parameters are received in rl-encoding.
+        """
+        i = self.batch_count
+        self.batch_states[i] = state
+        self.batch_actions[i] = action
+        self.batch_targets[i] = new_value
+        self.batch_count += 1
+        if self.batch_count == self.batch_size:
+            self.train_batch(self.batch_states, self.batch_actions,
+                             self.batch_targets)
+            self.batch_count = 0
+
+    def get_value(self, state, action):
+        """Return the value for the (state, action) pair.
+
+        The parameters are received in rl-encoding.
+        """
+        return self.get_state_values(state)[action]
+
+    def get_state_values(self, state):
+        """Return an array of the action values for the give state.
+
+        The parameters are received in rl-encoding.
+        """
+        return self.forward(numpy.asarray(state, dtype=float)[None, :])[0]
+
+    def get_max_value(self, state):
+        """Return the maximum action value for the given state.
+
+        Uses the target network when there is one.
+        The parameters are received in rl-encoding.
+        """
+        params = self.target_params if self.target_update else self.params
+        state = numpy.asarray(state, dtype=float)[None, :]
+        return self.forward(state, params)[0].max()
+
+    def get_values(self, states, actions):
+        """Return the values of arrays of (state, action) pairs.
+
+        The parameters are received in rl-encoding.
+        """
+        values = self.forward(numpy.asarray(states, dtype=float))
+        return values[numpy.arange(len(values)), actions]
+
+    def get_max_values(self, states):
+        """Return the maximum action values of an array of states.
+
+        Uses the target network when there is one.
+        The parameters are received in rl-encoding.
+        """
+        params = self.target_params if self.target_update else self.params
+        states = numpy.asarray(states, dtype=float)
+        return self.forward(states, params).max(axis=1)
+
+    def update_values(self, states, actions, deltas):
+        """Train on arrays of (state, action) pairs moved by deltas.
+
+        The pairs are trained on at once as their own minibatch, leaving
+        the pending one of store_value alone.
+        The parameters are received in rl-encoding.
+        """
+        states = numpy.asarray(states, dtype=float)
+        targets = self.get_values(states, actions) + deltas
+        self.train_batch(states, numpy.asarray(actions), targets)
+
+    def load(self, filename):
+        """Retrieve a persisted storage from a file."""
+        handler = open(filename, 'rb')
+        self.set_arrays(pickle.load(handler))
+
+    def dump(self, filename):
+        """Persist the storage to a file."""
+        handler = open(filename, 'wb')
+        pickle.dump(self.get_arrays(), handler, pickle.HIGHEST_PROTOCOL)
+
+    def get_arrays(self):
+        """Return a dictionary with the arrays that hold the storage data."""
+        arrays = {'train_steps': numpy.array(self.train_steps)}
+        for name, params in (('param', self.params),
+                             ('target', self.target_params),
+                             ('moment', self.moments),
+                             ('velocity', self.velocities)):
+            for i, param in enumerate(params):
+                arrays['%s%d' % (name, i)] = param
+        return arrays
+
+    def set_arrays(self, arrays):
+        """Restore the storage data from a dictionary of arrays."""
+        self.train_steps = int(arrays['train_steps'])
+        for name, params in (('param', self.params),
+                             ('target', self.target_params),
+                             ('moment', self.moments),
+                             ('velocity', self.velocities)):
+            for i in range(len(params)):
+                params[i] = numpy.array(arrays['%s%d' % (name, i)],
+                                        dtype=float)
+
 
 class DebugTableStorage(TableStorage):
 
@@ -140,9 +1380,11 @@ class DebugTableStorage(TableStorage):
     def count_hits(self):
         """Return the total number of times the current state has been
         visited."""
-        return numpy.sum(self.debug_state)
+        return numpy.sum(self.state_visits)
 
-    def __init__(self, encoder, mappings=None):
+    def __init__(self, encoder, mappings=None, dtype=numpy.float64,
+                 count_dtype=numpy.float64, track_precision=False,
+                 sample_rate=1):
         """Initialize the storage.
         
         Arguments:
@@ -152,10 +1394,30 @@ class DebugTableStorage(TableStorage):
         Keyword arguments:
         mappings -- a dictionary with two keys, True and False, that contain a
                     set of (state, action) pairs.
+        dtype -- data type of the values.
+        count_dtype -- data type of the visit counts, e.g. numpy.uint32 or
+                       numpy.uint16. Integer counts saturate at their maximum.
+        track_precision -- if True keep statistics of the rounding error
+                           introduced by dtype (see precision_report).
+        sample_rate -- fraction of the updates used for the per-episode
+                       statistics. Visit counts are always kept exactly.
         """
-        super(DebugTableStorage, self).__init__(encoder, mappings=mappings)
+        super(DebugTableStorage, self).__init__(
+            encoder, mappings=mappings, dtype=dtype,
+            track_precision=track_precision)
+        self.count_dtype = numpy.dtype(count_dtype)
+        if self.count_dtype.kind in 'iu':
+            self.max_count = numpy.iinfo(self.count_dtype).max
+        else:
+            self.max_count = numpy.inf
         self.debug_state = numpy.zeros((encoder.input_size, 
-                                        encoder.output_size))
+                                        encoder.output_size),
+                                       dtype=self.count_dtype)
+        # visits per state, kept along with debug_state
+        self.state_visits = numpy.zeros(encoder.input_size, dtype=numpy.int64)
+        self.sample_rate = sample_rate
+        self.random = random.Random()
+        self.sampled_visits = 0
         self.new_state_visits = 0
         self.sum_state_visits = 0
         self.new_state_action_visits = 0
@@ -168,48 +1430,98 @@ class DebugTableStorage(TableStorage):
 
         The parameters are received in rl-encoding.
         """
-        self.value_change += abs(new_value-self.state[state, action])
+        sample = (self.sample_rate >= 1 or
+                  self.random.random() < self.sample_rate)
+        if sample:
+            self.value_change += abs(new_value-self.state[state, action])
         super(DebugTableStorage, self).store_value(state, action, new_value)
-        self.sum_state_action_visits += self.debug_state[state, action]
-        self.sum_state_visits += sum(self.debug_state[state])
-        if sum(self.debug_state[state]) == 0:
-            self.new_state_visits += 1
-        if self.debug_state[state, action] == 0:
-            self.new_state_action_visits += 1
+        visits = self.debug_state[state, action]
+        if sample:
+            state_visits = self.state_visits[state]
+            self.sampled_visits += 1
+            self.sum_state_action_visits += visits
+            self.sum_state_visits += state_visits
+            if state_visits == 0:
+                self.new_state_visits += 1
+            if visits == 0:
+                self.new_state_action_visits += 1
         self.total_visits += 1
-        self.debug_state[state, action] += 1
+        if visits < self.max_count:
+            self.debug_state[state, action] = visits + 1
+        self.state_visits[state] += 1
+
+    def update_values(self, states, actions, deltas):
+        """Add deltas to the values of arrays of (state, action) pairs.
+
+        The pairs are updated one by one so that every visit is counted.
+        The parameters are received in rl-encoding.
+        """
+        Storage.update_values(self, states, actions, deltas)
+
+    def get_arrays(self):
+        """Return a dictionary with the arrays that hold the storage data."""
+        arrays = super(DebugTableStorage, self).get_arrays()
+        arrays['debug_state'] = self.debug_state
+        return arrays
+
+    def set_arrays(self, arrays):
+        """Restore the storage data from a dictionary of arrays."""
+        super(DebugTableStorage, self).set_arrays(arrays)
+        self.debug_state = numpy.array(arrays['debug_state'],
+                                       dtype=self.count_dtype)
+        self.state_visits = self.debug_state.sum(axis=1, dtype=numpy.int64)
+
+    def report(self):
+        """Return a dictionary with the usage statistics.
+
+        Coverage and medians are computed over the whole table, the rest of
+        the values over the (sampled) updates of the current episode.
+        """
+        sampled = float(max(self.sampled_visits, 1))
+        return {
+            'state_coverage':
+                numpy.count_nonzero(self.state_visits) /
+                float(self.state_visits.size),
+            'state_visits_median': numpy.median(self.state_visits),
+            'state_action_coverage':
+                numpy.count_nonzero(self.debug_state) /
+                float(self.debug_state.size),
+            'state_action_visits_median': numpy.median(self.debug_state),
+            'total_visits': self.total_visits,
+            'sampled_visits': self.sampled_visits,
+            'new_state_visits': self.new_state_visits,
+            'new_state_visits_rate': self.new_state_visits / sampled,
+            'new_state_action_visits': self.new_state_action_visits,
+            'new_state_action_visits_rate':
+                self.new_state_action_visits / sampled,
+            'mean_state_visits': self.sum_state_visits / sampled,
+            'mean_state_action_visits':
+                self.sum_state_action_visits / sampled,
+            'value_change': self.value_change,
+            'mean_value_change': self.value_change / sampled,
+            }
 
     def print_report(self):
         """Print out report."""
-        shape = self.debug_state.shape
-        print "Dimension usage variation"
-        print "Dimension usage median"
-        print "Dimension usage average"
-        print "Dimension coverage"
-        print "State Coverage", \
-            len(numpy.nonzero(numpy.sum(self.debug_state,1)))/float(shape[0])
-        #print self.debug_state
-        print "State Coverage median", \
-            numpy.median(numpy.sum(self.debug_state, 1))
-        sz = shape[0]*shape[1]
-        print "State-Action Coverage", \
-            len(numpy.nonzero(self.debug_state.reshape(sz)))/float(sz)
+        report = self.report()
+        print "State Coverage", report['state_coverage']
+        print "State Coverage median", report['state_visits_median']
+        print "State-Action Coverage", report['state_action_coverage']
         print "State-Action Coverage median", \
-            numpy.median(numpy.median(self.debug_state))
+            report['state_action_visits_median']
         print "new states visited:", \
-            self.new_state_visits, "%0.2f%%" % (
-                100*self.new_state_visits/float(self.total_visits))
+            report['new_state_visits'], "%0.2f%%" % (
+                100*report['new_state_visits_rate'])
         print "new actions taken:", \
-            self.new_state_action_visits, "%0.2f%%" % (
-                100*self.new_state_action_visits/float(self.total_visits))
+            report['new_state_action_visits'], "%0.2f%%" % (
+                100*report['new_state_action_visits_rate'])
         print "sum state visit", \
-            self.sum_state_visits, "%0.2f" % (
-                self.sum_state_visits/self.total_visits)
+            self.sum_state_visits, "%0.2f" % report['mean_state_visits']
         print "sum state action visit", \
             self.sum_state_action_visits, "%0.2f" % (
-                self.sum_state_action_visits/self.total_visits)
+                report['mean_state_action_visits'])
         print "value change", \
-            self.value_change, self.value_change/float(self.total_visits)
+            report['value_change'], report['mean_value_change']
 
     def new_episode(self):
         """Start a new episode.
@@ -217,6 +1529,7 @@ class DebugTableStorage(TableStorage):
         Histories and traces should be cleared here.
         """
         super(DebugTableStorage, self).new_episode()
+        self.sampled_visits = 0
         self.new_state_visits = 0
         self.sum_state_visits = 0
         self.new_state_action_visits = 0
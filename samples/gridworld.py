@@ -102,7 +102,7 @@ if __name__ == "__main__":
                    (3,6), (4,6), (5,6), (6,6)
                ])
     space = g.get_state_space(), g.get_action_space()
-    encoder = reply.encoder.DistanceEncoder(*space)
+    encoder = reply.encoder.DistanceEncoder(*space, scalar_actions=True)
     storage = reply.storage.TableStorage(encoder)
     #learner = reply.learner.QLearner(1, 0.01,0.99, 0.05)
     learner = reply.learner.SarsaLearner(1, 0.01,0.99, 0.05)
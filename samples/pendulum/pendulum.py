@@ -4,7 +4,7 @@ import os
 sys.path.insert(0, os.path.join(os.path.dirname(__file__), '../..'))
 #
 
-import random, cPickle
+import random
 import math
 
 from pyglet import window
@@ -150,19 +150,20 @@ class Pendulum(reply.World):
         epsilon = 0.99
         epsilon_decay = 0.99
         min_epsilon = 0.001
-        self.filename = filename
+        self.checkpointer = reply.checkpoint.DeltaCheckpointer(filename)
+        e = reply.encoder.DistanceEncoder(
+            self.get_state_space(), self.get_action_space()
+            )
+        pend = reply.RL(
+                reply.learner.QLearner(alpha, gamma, alpha_decay, min_alpha),
+                reply.storage.DebugTableStorage(e),
+                e,
+                reply.selector.EGreedySelector(epsilon, epsilon_decay, min_epsilon)
+            )
         try:
-            pend = cPickle.load(open(filename))
+            self.checkpointer.load(pend)
         except IOError:
-            e = reply.encoder.DistanceEncoder(
-                self.get_state_space(), self.get_action_space()
-                )
-            pend = reply.RL(
-                    reply.learner.QLearner(alpha, gamma, alpha_decay, min_alpha),
-                    reply.storage.DebugTableStorage(e),
-                    e,
-                    reply.selector.EGreedySelector(epsilon, epsilon_decay, min_epsilon)
-                )
+            pass
         self.rl = pend
         self.win = window.Window(width=800, height=600)
         self.figure = None
@@ -265,7 +266,7 @@ class Pendulum(reply.World):
         return self.get_state()
 
     def save(self):
-        cPickle.dump(self.rl, open(self.filename, "w"))
+        self.checkpointer.save(self.rl)
 
     def cleanUp(self):
         cp.cpSpaceFree( self.space )
@@ -288,7 +289,7 @@ class Pendulum(reply.World):
             self.save()
 
 def run(maxepisodes):
-    p = Pendulum("pendulum.pkl")
+    p = Pendulum("pendulum.npz")
     p.learn(maxepisodes)
 
 
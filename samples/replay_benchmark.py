@@ -0,0 +1,55 @@
+# This code is so you can run the samples without installing the package
+import sys
+import os
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+#
+
+import reply
+import numpy
+import time
+
+SIZE = 10 ** 6
+BATCH_SIZE = 32
+ROUNDS = 2000
+
+
+def fill(buffer, size):
+    "Fill the buffer with random transitions without appending one by one."
+    buffer.allocate(0)
+    buffer.states[:size] = numpy.random.randint(0, 1000, size)
+    buffer.next_states[:size] = numpy.random.randint(0, 1000, size)
+    buffer.actions[:size] = numpy.random.randint(0, 4, size)
+    buffer.rewards[:size] = numpy.random.random(size)
+    buffer.size = size
+    buffer.position = size % buffer.capacity
+    if isinstance(buffer, reply.replay.PrioritizedReplayBuffer):
+        buffer.update_priorities(numpy.arange(size), numpy.random.random(size))
+
+
+def bench(buffer):
+    start = time.time()
+    for i in xrange(ROUNDS):
+        buffer.sample_weighted(BATCH_SIZE)
+    sample = (time.time() - start) / ROUNDS
+    start = time.time()
+    for i in xrange(ROUNDS):
+        indices = numpy.random.randint(0, len(buffer), BATCH_SIZE)
+        buffer.update_priorities(indices, numpy.random.random(BATCH_SIZE))
+    update = (time.time() - start) / ROUNDS
+    start = time.time()
+    for i in xrange(ROUNDS):
+        buffer.append(0, 0, 0.0, 0)
+    append = (time.time() - start) / ROUNDS
+    return sample, update, append
+
+
+if __name__ == '__main__':
+    size = int(sys.argv[1]) if len(sys.argv) > 1 else SIZE
+    print 'transitions: %d  batch size: %d' % (size, BATCH_SIZE)
+    print '%-24s %12s %12s %12s' % ('buffer', 'sample', 'priorities', 'append')
+    for buffer in (reply.replay.ReplayBuffer(size),
+                   reply.replay.PrioritizedReplayBuffer(size)):
+        fill(buffer, size)
+        timings = [t * 1e6 for t in bench(buffer)]
+        print '%-24s %10.1fus %10.1fus %10.1fus' % (
+            (buffer.__class__.__name__,) + tuple(timings))